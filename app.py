@@ -1,24 +1,100 @@
 import json
 import os
-from flask import Flask, render_template, request, redirect, url_for, session
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
-import pymysql  # pastikan terimport
 
 app = Flask(__name__)
 app.secret_key = "awikwok"
 
-app.config["SQLALCHEMY_DATABASE_URI"] = "mysql+pymysql://root:@localhost/bengkel_db"
+# default MySQL; untuk cabang kecil / testing bisa pakai SQLite tanpa server:
+#   DATABASE_URL=sqlite:///bengkel.db python app.py   (file dibuat di folder instance/)
+app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get(
+    "DATABASE_URL", "mysql+pymysql://root:@localhost/bengkel_db"
+)
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
 db = SQLAlchemy(app)
 
+
+# ---------------------------------------------------------------------------
+# Mode SQLite: WAL + pragma yang disetel untuk satu server bengkel
+# ---------------------------------------------------------------------------
+import sqlite3
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",       # pembaca tidak diblokir penulis
+    "PRAGMA synchronous=NORMAL",     # aman di WAL, fsync hanya saat checkpoint
+    "PRAGMA busy_timeout=5000",      # tunggu lock maks 5 detik, bukan langsung "database is locked"
+    "PRAGMA foreign_keys=ON",        # sama seperti InnoDB di MySQL
+    "PRAGMA cache_size=-32000",      # page cache 32 MB per koneksi
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",    # 256 MB, baca halaman langsung dari page cache OS
+)
+
+
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+def using_sqlite():
+    return app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite")
+
+
+DEFAULT_BRANCH_ID = 1   # cabang pusat; data lama sebelum multi-cabang masuk ke sini
+
+
+def branch_column():
+    return db.Column(db.Integer, db.ForeignKey("branches.id"), nullable=False,
+                     default=DEFAULT_BRANCH_ID, server_default=str(DEFAULT_BRANCH_ID))
+
+
+class BranchDB(db.Model):
+    __tablename__ = "branches"
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+    address = db.Column(db.Text)
+
 class SparepartDB(db.Model):
     __tablename__ = "spareparts"
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
     price = db.Column(db.Float, nullable=False)
-    stock = db.Column(db.Integer, default=0)
+    stock = db.Column(db.Integer, default=0)   # stok lama (sebelum multi-cabang), sekarang di branch_stock
+
+class BranchStockDB(db.Model):
+    """Stok 1 sparepart di 1 cabang."""
+    __tablename__ = "branch_stock"
+    id = db.Column(db.Integer, primary_key=True)
+    branch_id = branch_column()
+    sparepart_id = db.Column(db.Integer, db.ForeignKey("spareparts.id"), nullable=False)
+    stock = db.Column(db.Integer, nullable=False, default=0)
+    # ROP & flag stok menipis, dijaga saat stok/pemakaian berubah (lihat refresh_stock_alerts)
+    rop = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rop_date = db.Column(db.Date)               # tanggal ROP terakhir dihitung
+    low_stock = db.Column(db.Boolean, nullable=False, default=False, server_default="0")
+
+    sparepart = db.relationship(
+        "SparepartDB", backref=db.backref("branch_stocks", cascade="all, delete-orphan")
+    )
+
+    __table_args__ = (
+        db.UniqueConstraint("branch_id", "sparepart_id", name="uq_branch_stock_branch_sparepart"),
+        db.Index("ix_branch_stock_branch_low", "branch_id", "low_stock"),
+    )
+
+    @property
+    def reorder_qty(self):
+        """Saran jumlah pembelian: selisih ROP dengan stok sekarang."""
+        return max((self.rop or 0) - (self.stock or 0), 0)
 
 class ServiceDB(db.Model):
     __tablename__ = "services"
@@ -26,25 +102,28 @@ class ServiceDB(db.Model):
     name = db.Column(db.String(100), unique=True, nullable=False)
     price = db.Column(db.Float, nullable=False)
     description = db.Column(db.Text)
+    duration_minutes = db.Column(db.Integer, nullable=False, default=60, server_default="60")
 
 class TransactionDB(db.Model):
     __tablename__ = "transactions"
 
     id = db.Column(db.Integer, primary_key=True)
+    branch_id = branch_column()
 
     # Waktu & customer
-    date = db.Column(db.Date, nullable=False)
-    customer_username = db.Column(db.String(50), nullable=False)
-    customer = db.Column(db.String(100), nullable=False)
+    date = db.Column(db.Date, nullable=False, index=True)
+    customer_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+    customer_username = db.Column(db.String(50), nullable=False, index=True)
+    customer = db.Column(db.String(100), nullable=False, index=True)
 
     # Relasi layanan
     service_id = db.Column(db.Integer, db.ForeignKey("services.id"), nullable=False)
-    service_name = db.Column(db.String(100), nullable=False)
+    service_name = db.Column(db.String(100), nullable=False, index=True)
     price_service = db.Column(db.Float, default=0)
 
     # Relasi sparepart (1 transaksi maksimal 1 jenis sparepart)
     sparepart_id = db.Column(db.Integer, db.ForeignKey("spareparts.id"))
-    sparepart_name = db.Column(db.String(255))      # disimpan untuk tampilan
+    sparepart_name = db.Column(db.String(255), index=True)      # disimpan untuk tampilan
     price_spare = db.Column(db.Float, default=0)
 
     # Total & status
@@ -53,13 +132,57 @@ class TransactionDB(db.Model):
 
     # Penugasan karyawan (opsional)
     employee_id = db.Column(db.Integer)
-    employee_name = db.Column(db.String(100))
+    employee_name = db.Column(db.String(100), index=True)
+
+    # Kendaraan yang dikerjakan (opsional, transaksi lama tidak punya)
+    vehicle_id = db.Column(db.Integer, db.ForeignKey("vehicles.id"))
+
+    # Jejak waktu job (diisi otomatis saat penugasan / status berubah)
+    assigned_at = db.Column(db.DateTime)
+    completed_at = db.Column(db.DateTime)
+    parts_wait_since = db.Column(db.DateTime)    # sedang "Menunggu Sparepart" sejak
+    parts_wait_seconds = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     # Relasi objek
     service = db.relationship("ServiceDB")
     sparepart = db.relationship("SparepartDB")
+    customer_user = db.relationship("UserDB")
+    branch = db.relationship("BranchDB")
+    vehicle = db.relationship("VehicleDB")
+
+    __table_args__ = (
+        # covering index untuk riwayat & ringkasan dashboard customer (lintas cabang)
+        db.Index("ix_transactions_customer_date", "customer_id", "date", "status", "total"),
+        # covering index untuk agregasi per periode di 1 cabang
+        db.Index("ix_transactions_branch_date_total", "branch_id", "date", "total"),
+        db.Index("ix_transactions_branch_status", "branch_id", "status", "employee_id"),
+        # riwayat servis 1 kendaraan (lintas cabang)
+        db.Index("ix_transactions_vehicle_date", "vehicle_id", "date"),
+        # metrik kinerja mekanik per periode selesai
+        db.Index("ix_transactions_branch_completed", "branch_id", "completed_at", "employee_id"),
+    )
 
 
+class TransactionItemDB(db.Model):
+    """Rincian sparepart per transaksi (boleh lebih dari 1 baris)."""
+    __tablename__ = "transaction_items"
+    id = db.Column(db.Integer, primary_key=True)
+    transaction_id = db.Column(db.Integer, db.ForeignKey("transactions.id"), nullable=False, index=True)
+    branch_id = branch_column()                 # salinan transactions.branch_id untuk index
+    sparepart_id = db.Column(db.Integer, db.ForeignKey("spareparts.id"), nullable=False)
+    qty = db.Column(db.Integer, nullable=False, default=1)
+    unit_price = db.Column(db.Float, nullable=False, default=0)
+    date = db.Column(db.Date, nullable=False)   # salinan transactions.date untuk index
+
+    transaction = db.relationship(
+        "TransactionDB", backref=db.backref("items", cascade="all, delete-orphan")
+    )
+    sparepart = db.relationship("SparepartDB")
+
+    __table_args__ = (
+        db.Index("ix_transaction_items_branch_sparepart_date", "branch_id", "sparepart_id", "date", "qty"),
+    )
+
 
 class UserDB(db.Model):
     __tablename__ = "users"
@@ -69,6 +192,7 @@ class UserDB(db.Model):
     full_name = db.Column(db.String(100))
     email = db.Column(db.String(100))
     role = db.Column(db.String(20), nullable=False)  # owner/admin/employee/customer
+    branch_id = branch_column()                      # cabang asal (customer: cabang favorit)
 
 class EmployeeDB(db.Model):
     __tablename__ = "employees"
@@ -77,98 +201,2407 @@ class EmployeeDB(db.Model):
     name = db.Column(db.String(100), nullable=False)
     position = db.Column(db.String(50), nullable=False)   # Mekanik / Admin dll
     status = db.Column(db.String(20), default="Aktif")    # Aktif / Cuti / Nonaktif
+    branch_id = branch_column()
+
+    user = db.relationship("UserDB")
+
+    __table_args__ = (
+        db.Index("ix_employees_branch_status", "branch_id", "status"),
+    )
+
+class BookingDB(db.Model):
+    __tablename__ = "bookings"
+    id = db.Column(db.Integer, primary_key=True)
+    branch_id = branch_column()
+    customer_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    time = db.Column(db.Time, nullable=False)
+    service_id = db.Column(db.Integer, db.ForeignKey("services.id"), nullable=False)
+    note = db.Column(db.Text)
+    status = db.Column(db.String(50), default="Menunggu Konfirmasi")
+    vehicle_id = db.Column(db.Integer, db.ForeignKey("vehicles.id"), index=True)
+
+    customer = db.relationship("UserDB")
+    service = db.relationship("ServiceDB")
+    branch = db.relationship("BranchDB")
+    vehicle = db.relationship("VehicleDB")
+
+    __table_args__ = (
+        db.Index("ix_bookings_branch_date", "branch_id", "date", "time"),
+    )
+
+class BookingItemDB(db.Model):
+    __tablename__ = "booking_items"
+    id = db.Column(db.Integer, primary_key=True)
+    booking_id = db.Column(db.Integer, db.ForeignKey("bookings.id"), nullable=False)
+    sparepart_id = db.Column(db.Integer, db.ForeignKey("spareparts.id"), nullable=False)
+    qty = db.Column(db.Integer, nullable=False, default=1)
+
+    booking = db.relationship("BookingDB", backref="items")
+    sparepart = db.relationship("SparepartDB")
+
+class VehicleDB(db.Model):
+    """Kendaraan pelanggan. Plat disimpan apa adanya dan dalam bentuk ternormalisasi (kunci unik)."""
+    __tablename__ = "vehicles"
+    id = db.Column(db.Integer, primary_key=True)
+    customer_id = db.Column(db.Integer, db.ForeignKey("users.id"), index=True)   # kosong = tanpa akun
+    plate = db.Column(db.String(20), nullable=False)              # "B 2323 MD"
+    plate_normalized = db.Column(db.String(20), nullable=False)   # "B2323MD"
+    vehicle_type = db.Column(db.String(100))
+    owner_name = db.Column(db.String(100))
+    owner_phone = db.Column(db.String(30))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    customer = db.relationship("UserDB")
+
+    __table_args__ = (
+        db.Index("uq_vehicles_plate_normalized", "plate_normalized", unique=True),
+    )
+
+class AttendanceDB(db.Model):
+    __tablename__ = "attendance"
+    id = db.Column(db.Integer, primary_key=True)
+    branch_id = branch_column()
+    employee_id = db.Column(db.Integer, db.ForeignKey("employees.id"), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    check_in = db.Column(db.Time)
+    check_out = db.Column(db.Time)
+
+    employee = db.relationship("EmployeeDB")
+
+    __table_args__ = (
+        # 1 baris per karyawan per hari; juga kunci upsert check-in/check-out
+        db.Index("uq_attendance_employee_date", "employee_id", "date", unique=True),
+        db.Index("ix_attendance_branch_date", "branch_id", "date"),
+    )
+
+class ReportSnapshotDB(db.Model):
+    """Ringkasan laporan bulan yang sudah tutup (dibekukan, tidak dihitung ulang)."""
+    __tablename__ = "report_snapshots"
+    id = db.Column(db.Integer, primary_key=True)
+    branch_id = branch_column()
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    total_transaksi = db.Column(db.Integer, nullable=False, default=0)
+    total_pendapatan = db.Column(db.Float, nullable=False, default=0)
+    payload = db.Column(db.Text, nullable=False)   # JSON: ranking layanan & per karyawan
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    __table_args__ = (
+        db.UniqueConstraint("branch_id", "year", "month", name="uq_report_snapshots_branch_month"),
+    )
+
+class BookingSlotDB(db.Model):
+    """Jumlah booking yang menempati 1 slot waktu pada 1 hari di 1 cabang."""
+    __tablename__ = "booking_slots"
+    id = db.Column(db.Integer, primary_key=True)
+    branch_id = branch_column()
+    date = db.Column(db.Date, nullable=False)
+    slot = db.Column(db.Integer, nullable=False)      # nomor slot sejak jam buka
+    booked = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint("branch_id", "date", "slot", name="uq_booking_slots_branch_date_slot"),
+    )
+
+class AuditLogDB(db.Model):
+    """Riwayat perubahan (append-only): siapa mengubah status/penugasan transaksi atau stok."""
+    __tablename__ = "audit_log"
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    branch_id = db.Column(db.Integer)
+    user_id = db.Column(db.Integer)
+    username = db.Column(db.String(50))
+    entity = db.Column(db.String(20), nullable=False)      # transaction / sparepart
+    entity_id = db.Column(db.Integer, nullable=False)
+    action = db.Column(db.String(20), nullable=False)      # create / update / delete
+    field = db.Column(db.String(50))
+    old_value = db.Column(db.String(255))
+    new_value = db.Column(db.String(255))
+
+    __table_args__ = (
+        db.Index("ix_audit_log_entity", "entity", "branch_id", "entity_id", "created_at"),
+        db.Index("ix_audit_log_branch_created", "branch_id", "created_at"),
+    )
+
+class TableVersionDB(db.Model):
+    """Versi data per tabel, naik di transaksi yang sama dengan perubahannya (kunci cache)."""
+    __tablename__ = "table_versions"
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+from datetime import date, timedelta
+from sqlalchemy import func, select
+
+
+# ---------------------------------------------------------------------------
+# Cabang: setiap halaman hanya membaca data cabang yang sedang aktif
+# ---------------------------------------------------------------------------
+def current_branch_id():
+    """Cabang aktif di session (diisi saat login, owner bisa berpindah cabang)."""
+    return session.get("branch_id") or DEFAULT_BRANCH_ID
+
+
+def get_in_branch(model, obj_id, branch_id):
+    """Ambil 1 baris berdasarkan id, None kalau tidak ada atau milik cabang lain."""
+    if not obj_id:
+        return None
+    return model.query.filter_by(id=obj_id, branch_id=branch_id).first()
+
+
+def move_user_to_branch(user_id, branch_id):
+    """Akun login karyawan ikut cabang tempat ia terdaftar sebagai karyawan."""
+    user = UserDB.query.get(user_id) if user_id else None
+    if user is not None:
+        user.branch_id = branch_id
+
+
+def branch_stock_map(branch_id):
+    """{sparepart_id: stok} untuk 1 cabang dalam 1 query."""
+    return dict(
+        db.session.query(BranchStockDB.sparepart_id, BranchStockDB.stock)
+        .filter(BranchStockDB.branch_id == branch_id)
+        .all()
+    )
+
+
+def get_branch_stock(branch_id, sparepart_id):
+    """Baris stok sparepart di cabang; dibuat (stok 0) kalau belum ada."""
+    row = BranchStockDB.query.filter_by(branch_id=branch_id, sparepart_id=sparepart_id).first()
+    if row is None:
+        row = BranchStockDB(branch_id=branch_id, sparepart_id=sparepart_id, stock=0)
+        db.session.add(row)
+    return row
+
+
+LEAD_TIME_DAYS = 4  # asumsi lead time sama untuk semua sparepart
+
+def get_daily_usage_all(branch_id, sparepart_ids, days_back=30, connection=None):
+    """
+    Pemakaian harian (jumlah qty) untuk banyak sparepart sekaligus di 1 cabang,
+    1 query ke transaction_items lewat index (branch_id, sparepart_id, date).
+    `connection` dipakai saat dipanggil dari event flush.
+    """
+    today = date.today()
+    start_date = today - timedelta(days=days_back)
+    sparepart_ids = list(sparepart_ids)
+    if not sparepart_ids:
+        return {}
+
+    stmt = (
+        select(
+            TransactionItemDB.sparepart_id.label("sp"),
+            TransactionItemDB.date.label("d"),
+            func.sum(TransactionItemDB.qty).label("qty")
+        )
+        .where(
+            TransactionItemDB.branch_id == branch_id,
+            TransactionItemDB.sparepart_id.in_(sparepart_ids),
+            TransactionItemDB.date >= start_date
+        )
+        .group_by(TransactionItemDB.sparepart_id, TransactionItemDB.date)
+    )
+    rows = (connection or db.session).execute(stmt).all()
+
+    usage = {sp_id: {} for sp_id in sparepart_ids}
+    for r in rows:
+        usage[r.sp][r.d] = int(r.qty or 0)
+    days = [start_date + timedelta(days=i) for i in range(days_back)]
+    return {sp_id: [by_day.get(d, 0) for d in days] for sp_id, by_day in usage.items()}
+
+
+def get_daily_usage(branch_id, sparepart_id, days_back=30):
+    return get_daily_usage_all(branch_id, [sparepart_id], days_back)[sparepart_id]
+
+
+def _rop_from_series(series, lead_time):
+    if not series:
+        return 0, 0, 0, 0  # belum ada data
+
+    total = sum(series)
+    n = len(series)
+
+    avg_usage = total / n                # AU = pemakaian rata-rata
+    max_usage = max(series)             # pemakaian maksimum
+    safety_stock = (max_usage - avg_usage) * lead_time
+    rop = (lead_time * avg_usage) + safety_stock
+
+    # dibulatkan ke atas supaya aman
+    return (
+        round(avg_usage, 2),
+        int(max_usage),
+        int(round(safety_stock)),
+        int(round(rop)),
+    )
+
+
+def hitung_rop(branch_id, sparepart_id, days_back=30, lead_time=LEAD_TIME_DAYS):
+    """
+    Menghitung AU, pemakaian maks, safety stock, dan ROP untuk 1 sparepart
+    di 1 cabang. Menggunakan data pemakaian N hari terakhir.
+    """
+    return _rop_from_series(get_daily_usage(branch_id, sparepart_id, days_back), lead_time)
+
+
+def build_rop_map(branch_id, sparepart_ids, days_back=30, lead_time=LEAD_TIME_DAYS, connection=None):
+    """ROP per cabang untuk banyak sparepart dengan 1 query pemakaian."""
+    sparepart_ids = list(sparepart_ids)
+    usage = get_daily_usage_all(branch_id, sparepart_ids, days_back, connection=connection)
+    rop_map = {}
+    for sp_id in sparepart_ids:
+        avg_use, max_use, ss, rop = _rop_from_series(usage.get(sp_id, []), lead_time)
+        rop_map[sp_id] = {"avg": avg_use, "max": max_use, "ss": ss, "rop": rop}
+    return rop_map
+
+
+def sparepart_usage_summary(branch_id, start, end):
+    """Qty terpakai dan pendapatan per sparepart di 1 cabang pada rentang tanggal [start, end)."""
+    rows = (
+        db.session.query(
+            TransactionItemDB.sparepart_id,
+            func.sum(TransactionItemDB.qty).label("qty"),
+            func.sum(TransactionItemDB.qty * TransactionItemDB.unit_price).label("revenue"),
+        )
+        .filter(
+            TransactionItemDB.branch_id == branch_id,
+            TransactionItemDB.date >= start,
+            TransactionItemDB.date < end,
+        )
+        .group_by(TransactionItemDB.sparepart_id)
+        .all()
+    )
+    return {r.sparepart_id: {"qty": int(r.qty or 0), "revenue": r.revenue or 0} for r in rows}
+
+
+def set_transaction_items(trx, lines):
+    """
+    Ganti rincian sparepart transaksi. lines: list (sparepart, qty, harga satuan).
+    """
+    trx.items = [
+        TransactionItemDB(sparepart_id=spare.id, qty=qty, unit_price=unit_price,
+                          date=trx.date, branch_id=trx.branch_id)
+        for spare, qty, unit_price in lines
+    ]
+
+
+# ---------------------------------------------------------------------------
+# Cache fragmen HTML untuk tabel besar (isi <tbody>)
+# ---------------------------------------------------------------------------
+import threading
+from collections import OrderedDict
+from markupsafe import Markup
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+app.config.setdefault("FRAGMENT_CACHE_MAX_ENTRIES", 256)
+app.config.setdefault("FRAGMENT_CACHE_MAX_BYTES", 8 * 1024 * 1024)  # 8 MB
+
+
+class FragmentCache:
+    """
+    Cache LRU untuk potongan HTML yang sudah dirender.
+    Dibatasi jumlah entri dan total ukuran (byte); entri paling lama
+    tidak dipakai dibuang lebih dulu.
+    """
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            html = self._data.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def set(self, key, html):
+        size = len(html.encode("utf-8"))
+        if size > self.max_bytes:
+            return  # terlalu besar, tidak usah disimpan
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._size -= len(old.encode("utf-8"))
+            self._data[key] = html
+            self._size += size
+            while self._data and (
+                len(self._data) > self.max_entries or self._size > self.max_bytes
+            ):
+                _, evicted = self._data.popitem(last=False)
+                self._size -= len(evicted.encode("utf-8"))
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+
+
+fragment_cache = FragmentCache(
+    app.config["FRAGMENT_CACHE_MAX_ENTRIES"],
+    app.config["FRAGMENT_CACHE_MAX_BYTES"],
+)
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_tables(session, flush_context):
+    changed = session.info.setdefault("changed_tables", set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(obj, "__tablename__", None)
+        if table:
+            changed.add(table)
+
+
+@event.listens_for(Session, "after_bulk_update")
+@event.listens_for(Session, "after_bulk_delete")
+def _collect_bulk_changed_tables(context):
+    table = context.mapper.local_table.name
+    context.session.info.setdefault("changed_tables", set()).add(table)
+
+
+def mark_tables_changed(*table_names):
+    """Untuk perubahan lewat bulk update/insert yang tidak lewat flush ORM."""
+    db.session.info.setdefault("changed_tables", set()).update(table_names)
+
+
+def bump_table_versions(connection, table_names):
+    """
+    Naikkan versi di table_versions sebagai 1 upsert per tabel. Urutan nama
+    tetap supaya dua commit yang mengubah tabel yang sama tidak saling deadlock.
+    """
+    table = TableVersionDB.__table__
+    for name in sorted(table_names):
+        if connection.dialect.name == "mysql":
+            stmt = mysql_insert(table).values(name=name, version=1)
+            stmt = stmt.on_duplicate_key_update(version=table.c.version + 1)
+        else:
+            stmt = sqlite_insert(table).values(name=name, version=1)
+            stmt = stmt.on_conflict_do_update(index_elements=["name"], set_={"version": table.c.version + 1})
+        connection.execute(stmt)
+
+
+@event.listens_for(Session, "before_commit")
+def _bump_changed_tables(session):
+    # before_commit jalan sebelum flush terakhir; flush dulu supaya semua tabel tercatat
+    session.flush()
+    changed = session.info.pop("changed_tables", None)
+    changed = {name for name in changed or () if name != TableVersionDB.__tablename__}
+    if changed:
+        bump_table_versions(session.connection(), changed)
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _discard_changed_tables(session):
+    session.info.pop("changed_tables", None)
+
+
+def data_version(*models):
+    """
+    Versi data gabungan beberapa tabel dari table_versions, dibaca dengan 1 query.
+    Versi ikut naik di transaksi yang mengubah tabel, jadi insert/update/delete
+    dari worker atau perintah CLI lain juga membuat cache lama tidak terpakai.
+    """
+    names = [model.__tablename__ for model in models]
+    versions = dict(
+        db.session.query(TableVersionDB.name, TableVersionDB.version)
+        .filter(TableVersionDB.name.in_(names))
+        .all()
+    )
+    return tuple((name, versions.get(name, 0)) for name in names)
+
+
+def render_fragment(template_name, models, loader, **key_args):
+    """
+    Render potongan template dengan cache.
+    `loader` hanya dipanggil saat cache miss dan harus mengembalikan dict
+    konteks untuk template. `key_args` ikut jadi bagian kunci cache
+    (misalnya filter bulan/tahun).
+    """
+    key = (template_name, data_version(*models), tuple(sorted(key_args.items())))
+    html = fragment_cache.get(key)
+    if html is None:
+        context = dict(key_args)
+        context.update(loader())
+        html = render_template(template_name, **context)
+        fragment_cache.set(key, html)
+    return Markup(html)
+
+
+def month_range(year, month):
+    """Tanggal awal (inklusif) dan akhir (eksklusif) untuk satu bulan."""
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start, end
+
+
+def transaction_rows_fragment(branch_id):
+    return render_fragment(
+        "partials/transaction_rows.html",
+        (TransactionDB,),
+        lambda: {
+            "transactions": TransactionDB.query.filter_by(branch_id=branch_id)
+                                               .order_by(TransactionDB.id.asc()).all()
+        },
+        branch_id=branch_id,
+    )
+
+
+# ---------------------------------------------------------------------------
+# Stok menipis: ROP & flag low_stock disimpan di branch_stock
+# ---------------------------------------------------------------------------
+from collections import defaultdict
+from sqlalchemy import and_, bindparam, case, or_, update, inspect as sa_inspect
+from sqlalchemy.orm import joinedload
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_stock_alert_pairs(session, flush_context, instances):
+    """Catat (cabang, sparepart) yang stoknya atau pemakaiannya (input ROP) berubah."""
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+        if isinstance(obj, TransactionItemDB):
+            pairs = session.info.setdefault("stock_alert_usage", set())
+            sparepart_ids = {obj.sparepart_id}
+            if obj in session.dirty:
+                history = sa_inspect(obj).attrs.sparepart_id.history
+                sparepart_ids.update(history.deleted or ())
+        elif isinstance(obj, BranchStockDB) and obj not in session.deleted:
+            pairs = session.info.setdefault("stock_alert_stock", set())
+            sparepart_ids = {obj.sparepart_id}
+        else:
+            continue
+        branch_id = obj.branch_id or DEFAULT_BRANCH_ID
+        pairs.update((branch_id, sp_id) for sp_id in sparepart_ids if sp_id is not None)
+
+
+@event.listens_for(Session, "after_flush")
+def _apply_stock_alerts(session, flush_context):
+    usage = session.info.pop("stock_alert_usage", set())
+    stock = session.info.pop("stock_alert_stock", set())
+    connection = session.connection()
+    if usage:
+        refresh_stock_alerts(usage, recompute_rop=True, connection=connection)
+    if stock - usage:
+        refresh_stock_alerts(stock - usage, recompute_rop=False, connection=connection)
+    if usage or stock:
+        session.info.setdefault("changed_tables", set()).add(BranchStockDB.__tablename__)
+
+
+def refresh_stock_alerts(pairs, recompute_rop=True, connection=None):
+    """
+    Perbarui rop (opsional) dan low_stock untuk pasangan (cabang, sparepart)
+    lewat UPDATE langsung, supaya halaman cukup membaca baris yang flag-nya aktif.
+    """
+    conn = connection or db.session.connection()
+    table = BranchStockDB.__table__
+    today = date.today()
+    rop_update = (
+        update(table)
+        .where(table.c.branch_id == bindparam("b_branch"), table.c.sparepart_id == bindparam("b_sparepart"))
+        .values(rop=bindparam("b_rop"), rop_date=bindparam("b_date"))
+    )
+    by_branch = defaultdict(set)
+    for branch_id, sp_id in pairs:
+        by_branch[branch_id].add(sp_id)
+    for branch_id, sp_ids in by_branch.items():
+        if recompute_rop:
+            rop_map = build_rop_map(branch_id, sp_ids, connection=conn)
+            conn.execute(rop_update, [   # executemany: 1 statement untuk semua sparepart
+                {"b_branch": branch_id, "b_sparepart": sp_id, "b_rop": values["rop"], "b_date": today}
+                for sp_id, values in rop_map.items()
+            ])
+        conn.execute(
+            update(table)
+            .where(table.c.branch_id == branch_id, table.c.sparepart_id.in_(sp_ids))
+            .values(low_stock=case((and_(table.c.rop > 0, table.c.stock <= table.c.rop), True), else_=False))
+        )
+
+
+# {branch_id: tanggal} cabang yang ROP-nya sudah dipastikan terbaru di proses ini
+_stock_alerts_checked = {}
+
+
+def refresh_stale_stock_alerts(branch_id=None):
+    """
+    Jendela pemakaian ROP bergeser tiap hari: baris yang ROP-nya belum dihitung
+    hari ini dihitung ulang. Tugas hariannya `flask refresh-stock-alerts` (cron);
+    halaman baca hanya memanggilnya sebagai cadangan, paling sekali sehari per
+    cabang, lewat koneksi & transaksi sendiri supaya sesi request tidak ikut
+    ter-commit. Mengembalikan jumlah baris yang dihitung ulang.
+    """
+    today = date.today()
+    if branch_id is not None and _stock_alerts_checked.get(branch_id) == today:
+        return 0
+    table = BranchStockDB.__table__
+    query = select(table.c.branch_id, table.c.sparepart_id).where(
+        or_(table.c.rop_date.is_(None), table.c.rop_date < today)
+    )
+    if branch_id is not None:
+        query = query.where(table.c.branch_id == branch_id)
+    with db.engine.begin() as conn:
+        stale = conn.execute(query).all()
+        if stale:
+            refresh_stock_alerts(stale, connection=conn)
+            bump_table_versions(conn, [BranchStockDB.__tablename__])
+    if branch_id is not None:
+        _stock_alerts_checked[branch_id] = today
+    return len(stale)
+
+
+def low_stock_rows(branch_id):
+    """Baris branch_stock yang stoknya <= ROP (ROP > 0), kekurangan terbesar di atas."""
+    refresh_stale_stock_alerts(branch_id)
+    return (
+        BranchStockDB.query.options(joinedload(BranchStockDB.sparepart))
+        .filter_by(branch_id=branch_id, low_stock=True)
+        .order_by((BranchStockDB.rop - BranchStockDB.stock).desc(), BranchStockDB.sparepart_id.asc())
+        .all()
+    )
+
+
+def stored_rop_map(branch_id):
+    """{sparepart_id: {"rop": ...}} dari nilai ROP yang tersimpan di branch_stock."""
+    refresh_stale_stock_alerts(branch_id)
+    return {
+        sp_id: {"rop": rop}
+        for sp_id, rop in db.session.query(BranchStockDB.sparepart_id, BranchStockDB.rop)
+                                    .filter(BranchStockDB.branch_id == branch_id)
+    }
+
+
+# ---------------------------------------------------------------------------
+# Snapshot laporan bulanan
+# ---------------------------------------------------------------------------
+from sqlalchemy import delete, inspect as sa_inspect
+
+
+def month_is_closed(year, month):
+    return month_range(year, month)[1] <= date.today().replace(day=1)
+
+
+def compute_report_summary(filters, trx=TransactionDB):
+    """
+    Total, ranking layanan, dan total per karyawan lewat GROUP BY.
+    `trx` boleh berupa alias gabungan dari with_archive(); filters harus memakai kolom `trx`.
+    """
+    total_transaksi, total_pendapatan = (
+        db.session.query(func.count(trx.id), func.coalesce(func.sum(trx.total), 0))
+        .filter(*filters)
+        .one()
+    )
+    service_counts = (
+        db.session.query(trx.service_name, func.count(trx.id).label("cnt"))
+        .filter(*filters)
+        .group_by(trx.service_name)
+        .order_by(func.count(trx.id).desc())
+        .all()
+    )
+    employee_totals = (
+        db.session.query(
+            trx.employee_name,
+            func.count(trx.id).label("cnt"),
+            func.coalesce(func.sum(trx.total), 0).label("total"),
+        )
+        .filter(*filters)
+        .group_by(trx.employee_name)
+        .order_by(func.sum(trx.total).desc())
+        .all()
+    )
+    return {
+        "total_transaksi": int(total_transaksi),
+        "total_pendapatan": float(total_pendapatan or 0),
+        "layanan_terlaris": [{"name": name or "-", "count": cnt} for name, cnt in service_counts],
+        "per_karyawan": [
+            {"name": name or "Belum ditugaskan", "count": cnt, "total": float(total or 0)}
+            for name, cnt, total in employee_totals
+        ],
+    }
+
+
+def get_month_summary(branch_id, year, month):
+    """
+    Ringkasan 1 bulan di 1 cabang. Bulan yang sudah tutup diambil dari
+    snapshot; kalau belum ada, dihitung sekali lalu disimpan.
+    """
+    start, end = month_range(year, month)
+
+    def compute():
+        trx = with_archive(TransactionDB, start)
+        return compute_report_summary([trx.branch_id == branch_id, trx.date >= start, trx.date < end], trx)
+
+    if not month_is_closed(year, month):
+        return compute()
+
+    snap = ReportSnapshotDB.query.filter_by(branch_id=branch_id, year=year, month=month).first()
+    if snap is not None:
+        return json.loads(snap.payload)
+
+    summary = compute()
+    try:
+        with db.session.begin_nested():
+            db.session.add(ReportSnapshotDB(
+                branch_id=branch_id,
+                year=year,
+                month=month,
+                total_transaksi=summary["total_transaksi"],
+                total_pendapatan=summary["total_pendapatan"],
+                payload=json.dumps(summary),
+            ))
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()  # snapshot sudah dibuat request lain
+    return summary
+
+
+def invalidate_report_snapshots(branch_dates, connection=None):
+    """
+    Hapus snapshot bulan tutup yang datanya baru saja diubah (edit mundur).
+    branch_dates: pasangan (branch_id, tanggal).
+    """
+    months = {
+        (b, d.year, d.month) for b, d in branch_dates
+        if b is not None and d and month_is_closed(d.year, d.month)
+    }
+    if not months:
+        return
+    stmt = delete(ReportSnapshotDB.__table__).where(or_(*[
+        and_(ReportSnapshotDB.branch_id == b, ReportSnapshotDB.year == y, ReportSnapshotDB.month == m)
+        for b, y, m in months
+    ]))
+    (connection or db.session.connection()).execute(stmt)
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_report_dates(session, flush_context, instances):
+    dates = session.info.setdefault("report_dates", set())
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, TransactionDB):
+            dates.add((obj.branch_id, obj.date))
+    for obj in session.dirty:
+        if isinstance(obj, TransactionDB) and session.is_modified(obj):
+            history = sa_inspect(obj).attrs.date.history
+            for d in [*(history.added or ()), *(history.deleted or ()), *(history.unchanged or ())]:
+                dates.add((obj.branch_id, d))
+
+
+@event.listens_for(Session, "after_flush")
+def _invalidate_touched_snapshots(session, flush_context):
+    dates = session.info.pop("report_dates", None)
+    if dates:
+        invalidate_report_snapshots(dates, connection=session.connection())
+
+
+def build_report(branch_id, month, year, empty_rows_text=None, empty_summary_text=None):
+    """
+    Data laporan 1 cabang (owner & admin). Total, ranking layanan, dan total
+    per karyawan dihitung di database (atau dari snapshot untuk bulan yang
+    sudah tutup); baris tabel transaksi diambil dari cache fragmen.
+    """
+    if month and year:
+        start, end = month_range(year, month)
+        trx = with_archive(TransactionDB, start)
+        filters = [trx.branch_id == branch_id, trx.date >= start, trx.date < end]
+        summary = get_month_summary(branch_id, year, month)
+    else:
+        trx = with_archive(TransactionDB)
+        filters = [trx.branch_id == branch_id]
+        summary = compute_report_summary(filters, trx)
+    layanan_terlaris_list = summary["layanan_terlaris"]
+
+    report_rows = render_fragment(
+        "partials/report_rows.html",
+        (TransactionDB,),
+        lambda: {
+            "transactions": db.session.query(trx).filter(*filters)
+                                                 .order_by(trx.date.desc()).all()
+        },
+        branch_id=branch_id,
+        month=month if year else None,
+        year=year if month else None,
+        empty_text=empty_rows_text,
+    )
+    service_summary_rows = render_fragment(
+        "partials/service_summary_rows.html",
+        (TransactionDB,),
+        lambda: {"layanan_terlaris": layanan_terlaris_list},
+        branch_id=branch_id,
+        month=month if year else None,
+        year=year if month else None,
+        empty_text=empty_summary_text,
+    )
+    return {
+        "total_transaksi": summary["total_transaksi"],
+        "total_pendapatan": summary["total_pendapatan"],
+        "layanan_terlaris": layanan_terlaris_list,
+        "per_karyawan": summary["per_karyawan"],
+        "report_rows": report_rows,
+        "service_summary_rows": service_summary_rows,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Pencarian transaksi
+# ---------------------------------------------------------------------------
+from sqlalchemy import or_, text
+
+SEARCH_FIELDS = ("customer", "customer_username", "service_name", "sparepart_name", "employee_name")
+SEARCH_LIMIT_MAX = 200
+FTS_MIN_LENGTH = 3  # trigram (SQLite) / ngram (MySQL) butuh minimal 3 huruf
+
+
+def _like_escape(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _fts_candidate_filter(q):
+    """
+    Filter id transaksi lewat full-text index:
+    MySQL memakai FULLTEXT (parser ngram), SQLite memakai tabel FTS5 trigram.
+    """
+    phrase = '"' + q.replace('"', '""') + '"'
+    if db.engine.dialect.name == "mysql":
+        return text(
+            "MATCH (transactions.customer, transactions.customer_username, "
+            "transactions.service_name, transactions.sparepart_name, "
+            "transactions.employee_name) AGAINST (:fts_q IN BOOLEAN MODE)"
+        ).bindparams(fts_q=phrase)
+    return TransactionDB.id.in_(
+        text("SELECT rowid FROM transactions_fts WHERE transactions_fts MATCH :fts_q")
+        .bindparams(fts_q=phrase)
+        .columns(rowid=db.Integer)
+    )
+
+
+def search_transactions(branch_id, q=None, field=None, mode="prefix", date_from=None, date_to=None, limit=50):
+    """
+    Cari transaksi 1 cabang berdasarkan nama customer, username, layanan,
+    sparepart, dan karyawan, plus filter rentang tanggal.
+    mode "prefix" memakai index B-tree biasa (LIKE 'q%'),
+    mode "substring" memakai full-text index.
+    """
+    fields = (field,) if field in SEARCH_FIELDS else SEARCH_FIELDS
+    columns = [getattr(TransactionDB, f) for f in fields]
+    query = TransactionDB.query.filter(TransactionDB.branch_id == branch_id)
+
+    q = (q or "").strip()
+    if q:
+        if mode == "substring":
+            pattern = "%" + _like_escape(q) + "%"
+            if len(q) >= FTS_MIN_LENGTH:
+                query = query.filter(_fts_candidate_filter(q))
+            query = query.filter(or_(*[c.like(pattern, escape="\\") for c in columns]))
+        else:
+            pattern = _like_escape(q) + "%"
+            query = query.filter(or_(*[c.like(pattern, escape="\\") for c in columns]))
+
+    if date_from:
+        query = query.filter(TransactionDB.date >= date_from)
+    if date_to:
+        query = query.filter(TransactionDB.date <= date_to)
+
+    limit = max(1, min(limit or 50, SEARCH_LIMIT_MAX))
+    return query.order_by(TransactionDB.date.desc(), TransactionDB.id.desc()).limit(limit).all()
+
+
+# ---------------------------------------------------------------------------
+# Kendaraan: pencarian riwayat servis dari nomor plat
+# ---------------------------------------------------------------------------
+import re
+from sqlalchemy.exc import IntegrityError
+
+_PLATE_NOISE_RE = re.compile(r"[^0-9A-Z]")
+VEHICLE_HISTORY_LIMIT = 200
+
+
+def normalize_plate(plate):
+    """"b 2323-md" / "B2323 MD" -> "B2323MD" (kunci unik di tabel vehicles)."""
+    return _PLATE_NOISE_RE.sub("", (plate or "").upper())
+
+
+def display_plate(plate):
+    return " ".join((plate or "").upper().split())
+
+
+def vehicle_owned_by_other(plate, customer_id):
+    """True kalau plat sudah terdaftar atas nama pelanggan lain."""
+    normalized = normalize_plate(plate)
+    if not normalized:
+        return False
+    owner_id = db.session.query(VehicleDB.customer_id).filter_by(plate_normalized=normalized).scalar()
+    return owner_id is not None and owner_id != customer_id
+
+
+def get_or_create_vehicle(plate, customer=None, vehicle_type=None, owner_name=None, owner_phone=None,
+                          only_own=False):
+    """
+    Ambil kendaraan berdasarkan plat, buat baru kalau belum ada.
+    Plat kosong/tidak valid -> None. Data yang sudah ada tidak ditimpa, hanya dilengkapi.
+    only_own=True (input pelanggan): kendaraan milik pelanggan lain tidak dikaitkan -> None.
+    """
+    normalized = normalize_plate(plate)
+    if not normalized:
+        return None
+    vehicle = VehicleDB.query.filter_by(plate_normalized=normalized).first()
+    if vehicle is None:
+        try:
+            # savepoint: 2 request dengan plat sama bisa bersamaan, yang kalah cukup membaca ulang
+            with db.session.begin_nested():
+                vehicle = VehicleDB(
+                    plate=display_plate(plate), plate_normalized=normalized,
+                    customer_id=customer.id if customer else None,
+                    vehicle_type=vehicle_type or None,
+                    owner_name=owner_name or (customer.full_name if customer else None),
+                    owner_phone=owner_phone or None,
+                )
+                db.session.add(vehicle)
+        except IntegrityError:
+            vehicle = VehicleDB.query.filter_by(plate_normalized=normalized).one()
+    if only_own and vehicle.customer_id is not None and vehicle.customer_id != (customer.id if customer else None):
+        return None
+    if customer is not None and vehicle.customer_id is None:
+        vehicle.customer_id = customer.id
+    if vehicle_type and not vehicle.vehicle_type:
+        vehicle.vehicle_type = vehicle_type
+    return vehicle
+
+
+def vehicle_history(plate, limit=VEHICLE_HISTORY_LIMIT):
+    """
+    Riwayat servis 1 kendaraan di semua cabang dengan 1 query:
+    uq_vehicles_plate_normalized -> ix_transactions_vehicle_date (plus tabel
+    arsip kalau sudah berisi, supaya servis lama tetap terlihat).
+    Hasil: (vehicle, [(transaksi, nama cabang), ...]) atau (None, []) kalau plat tidak dikenal.
+    """
+    normalized = normalize_plate(plate)
+    if not normalized:
+        return None, []
+    trx = with_archive(TransactionDB)
+    rows = (
+        db.session.query(VehicleDB, trx, BranchDB.name)
+        .outerjoin(trx, trx.vehicle_id == VehicleDB.id)
+        .outerjoin(BranchDB, BranchDB.id == trx.branch_id)
+        .filter(VehicleDB.plate_normalized == normalized)
+        .order_by(trx.date.desc(), trx.id.desc())
+        .limit(limit)
+        .all()
+    )
+    if not rows:
+        return None, []
+    return rows[0][0], [(trx, branch_name) for _, trx, branch_name in rows if trx is not None]
+
+
+# ---------------------------------------------------------------------------
+# Kapasitas slot booking
+# ---------------------------------------------------------------------------
+WORKSHOP_OPEN_MINUTE = 8 * 60     # jam buka 08:00
+WORKSHOP_CLOSE_MINUTE = 17 * 60   # jam tutup 17:00
+SLOT_MINUTES = 30
+SLOTS_PER_DAY = (WORKSHOP_CLOSE_MINUTE - WORKSHOP_OPEN_MINUTE) // SLOT_MINUTES
+BOOKING_INACTIVE_STATUSES = ("Dibatalkan", "Ditolak")  # tidak memakai slot
+
+
+class SlotTree:
+    """
+    Segment tree (range add + range max) untuk jumlah booking per slot
+    dalam 1 hari. Cek "slot s..s+k masih muat?" cukup O(log n).
+    """
+
+    def __init__(self, counts):
+        self.n = max(1, len(counts))
+        self._max = [0] * (4 * self.n)
+        self._lazy = [0] * (4 * self.n)
+        if counts:
+            self._build(1, 0, self.n - 1, counts)
+
+    def _build(self, node, lo, hi, counts):
+        if lo == hi:
+            self._max[node] = counts[lo]
+            return
+        mid = (lo + hi) // 2
+        self._build(node * 2, lo, mid, counts)
+        self._build(node * 2 + 1, mid + 1, hi, counts)
+        self._max[node] = max(self._max[node * 2], self._max[node * 2 + 1])
+
+    def _push(self, node):
+        if self._lazy[node]:
+            for child in (node * 2, node * 2 + 1):
+                self._max[child] += self._lazy[node]
+                self._lazy[child] += self._lazy[node]
+            self._lazy[node] = 0
+
+    def add(self, start, end, value, node=1, lo=0, hi=None):
+        """Tambah `value` ke slot start..end-1."""
+        if hi is None:
+            hi = self.n - 1
+        if end <= lo or hi < start:
+            return
+        if start <= lo and hi < end:
+            self._max[node] += value
+            self._lazy[node] += value
+            return
+        self._push(node)
+        mid = (lo + hi) // 2
+        self.add(start, end, value, node * 2, lo, mid)
+        self.add(start, end, value, node * 2 + 1, mid + 1, hi)
+        self._max[node] = max(self._max[node * 2], self._max[node * 2 + 1])
+
+    def max(self, start, end, node=1, lo=0, hi=None):
+        """Jumlah booking terbanyak di antara slot start..end-1."""
+        if hi is None:
+            hi = self.n - 1
+        if end <= lo or hi < start:
+            return 0
+        if start <= lo and hi < end:
+            return self._max[node]
+        self._push(node)
+        mid = (lo + hi) // 2
+        return max(
+            self.max(start, end, node * 2, lo, mid),
+            self.max(start, end, node * 2 + 1, mid + 1, hi),
+        )
+
+
+def active_mechanics_query(branch_id):
+    return EmployeeDB.query.filter(
+        EmployeeDB.branch_id == branch_id,
+        EmployeeDB.status == "Aktif",
+        func.lower(EmployeeDB.position) == "mekanik",
+    )
+
+
+def active_mechanic_count(branch_id):
+    """Kapasitas per slot = jumlah mekanik Aktif di cabang tsb."""
+    return active_mechanics_query(branch_id).count()
+
+
+def slot_window(start_time, duration_minutes):
+    """
+    Ubah jam datang + durasi layanan menjadi rentang slot [first, last).
+    Mengembalikan None kalau di luar jam buka bengkel.
+    """
+    minute = start_time.hour * 60 + start_time.minute
+    if minute < WORKSHOP_OPEN_MINUTE:
+        return None
+    first = (minute - WORKSHOP_OPEN_MINUTE) // SLOT_MINUTES
+    n_slots = max(1, -(-(duration_minutes or SLOT_MINUTES) // SLOT_MINUTES))
+    if first + n_slots > SLOTS_PER_DAY:
+        return None
+    return first, first + n_slots
+
+
+def slot_label(slot):
+    minute = WORKSHOP_OPEN_MINUTE + slot * SLOT_MINUTES
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+def load_slot_tree(branch_id, day):
+    counts = [0] * SLOTS_PER_DAY
+    for row in BookingSlotDB.query.filter_by(branch_id=branch_id, date=day).all():
+        if 0 <= row.slot < SLOTS_PER_DAY:
+            counts[row.slot] = row.booked
+    return SlotTree(counts)
+
+
+def available_slots(branch_id, day, duration_minutes, capacity=None):
+    """Daftar jam mulai yang masih muat di 1 cabang untuk layanan dengan durasi tertentu."""
+    if capacity is None:
+        capacity = active_mechanic_count(branch_id)
+    tree = load_slot_tree(branch_id, day)
+    n_slots = max(1, -(-(duration_minutes or SLOT_MINUTES) // SLOT_MINUTES))
+    result = []
+    for first in range(0, SLOTS_PER_DAY - n_slots + 1):
+        free = capacity - tree.max(first, first + n_slots)
+        if free > 0:
+            result.append({"time": slot_label(first), "available": free})
+    return result
+
+
+def reserve_slots(branch_id, day, first, last, capacity):
+    """
+    Tambah counter slot secara atomik (UPDATE ... WHERE booked < kapasitas).
+    Baris slot dikunci berurutan sampai commit, jadi dua submit bersamaan
+    tidak bisa sama-sama lolos. False jika ada slot yang sudah penuh;
+    pemanggil wajib rollback.
+    """
+    existing = {
+        row.slot for row in
+        BookingSlotDB.query.filter(
+            BookingSlotDB.branch_id == branch_id,
+            BookingSlotDB.date == day,
+            BookingSlotDB.slot >= first,
+            BookingSlotDB.slot < last,
+        ).all()
+    }
+    for slot in range(first, last):
+        if slot in existing:
+            continue
+        try:
+            with db.session.begin_nested():
+                db.session.add(BookingSlotDB(branch_id=branch_id, date=day, slot=slot, booked=0))
+        except IntegrityError:
+            pass  # sudah dibuat oleh request lain
+
+    for slot in range(first, last):
+        updated = (
+            BookingSlotDB.query
+            .filter(
+                BookingSlotDB.branch_id == branch_id,
+                BookingSlotDB.date == day,
+                BookingSlotDB.slot == slot,
+                BookingSlotDB.booked < capacity,
+            )
+            .update({BookingSlotDB.booked: BookingSlotDB.booked + 1}, synchronize_session=False)
+        )
+        if updated == 0:
+            return False
+    return True
+
+
+def rebuild_booking_slots():
+    """Hitung ulang seluruh counter slot dari tabel bookings."""
+    BookingSlotDB.query.delete()
+    counts = {}
+    bookings = (
+        db.session.query(BookingDB.branch_id, BookingDB.date, BookingDB.time, ServiceDB.duration_minutes)
+        .join(ServiceDB, ServiceDB.id == BookingDB.service_id)
+        .filter(BookingDB.status.notin_(BOOKING_INACTIVE_STATUSES))
+        .all()
+    )
+    for branch_id, day, start_time, duration in bookings:
+        window = slot_window(start_time, duration)
+        if window is None:
+            continue
+        for slot in range(*window):
+            key = (branch_id, day, slot)
+            counts[key] = counts.get(key, 0) + 1
+    for (branch_id, day, slot), booked in counts.items():
+        db.session.add(BookingSlotDB(branch_id=branch_id, date=day, slot=slot, booked=booked))
+    db.session.commit()
+
+
+# ---------------------------------------------------------------------------
+# Rekap presensi
+# ---------------------------------------------------------------------------
+from sqlalchemy import and_, case
+
+LATE_AFTER_SECONDS = WORKSHOP_OPEN_MINUTE * 60   # masuk setelah jam buka = terlambat
+
+
+def record_attendance(employee, day, status, at_time):
+    """
+    Check-in ("Hadir") / check-out ("Pulang") sebagai 1 statement upsert di atas
+    uq_attendance_employee_date: tanpa SELECT dulu, dan klik ganda atau banyak
+    karyawan bersamaan tidak bisa membuat baris ganda. Check-in yang pertama
+    dipertahankan, check-out selalu yang terakhir.
+    """
+    table = AttendanceDB.__table__
+    values = {
+        "branch_id": employee.branch_id,
+        "employee_id": employee.id,
+        "date": day,
+        "check_in": at_time if status == "Hadir" else None,
+        "check_out": at_time if status == "Pulang" else None,
+    }
+    if db.engine.dialect.name == "mysql":
+        stmt = mysql_insert(table).values(**values)
+        new = stmt.inserted
+    else:
+        stmt = sqlite_insert(table).values(**values)
+        new = stmt.excluded
+    if status == "Hadir":
+        changes = {"check_in": func.coalesce(table.c.check_in, new.check_in)}
+    else:
+        changes = {"check_out": new.check_out}
+    if db.engine.dialect.name == "mysql":
+        stmt = stmt.on_duplicate_key_update(**changes)
+    else:
+        stmt = stmt.on_conflict_do_update(index_elements=["employee_id", "date"], set_=changes)
+    db.session.execute(stmt)
+    mark_tables_changed(AttendanceDB.__tablename__)
+    db.session.commit()
+
+
+def parse_month_param(value):
+    """'YYYY-MM' -> (tahun, bulan); default bulan berjalan."""
+    try:
+        parsed = datetime.strptime(value or "", "%Y-%m")
+        return parsed.year, parsed.month
+    except ValueError:
+        today = date.today()
+        return today.year, today.month
+
+
+def shift_month(year, month, delta):
+    index = year * 12 + (month - 1) + delta
+    return index // 12, index % 12 + 1
+
+
+def _seconds_of_day(column):
+    if db.engine.dialect.name == "mysql":
+        return func.time_to_sec(column)
+    # SQLite menyimpan TIME sebagai teks 'HH:MM:SS'
+    return func.cast(func.strftime("%s", column), db.Integer) - func.cast(func.strftime("%s", "00:00:00"), db.Integer)
+
+
+def attendance_summary_columns(att=AttendanceDB):
+    """Kolom agregat: hari hadir, total detik kerja, jumlah terlambat."""
+    in_s = _seconds_of_day(att.check_in)
+    out_s = _seconds_of_day(att.check_out)
+    worked = case(
+        (and_(att.check_in.isnot(None), att.check_out.isnot(None)), out_s - in_s),
+        else_=0,
+    )
+    return (
+        func.count(att.check_in).label("days_present"),
+        func.coalesce(func.sum(worked), 0).label("seconds_worked"),
+        func.coalesce(func.sum(case((in_s > LATE_AFTER_SECONDS, 1), else_=0)), 0).label("late_count"),
+    )
+
+
+def _summary_dict(row):
+    return {
+        "days_present": int(row.days_present or 0),
+        "hours_worked": round(int(row.seconds_worked or 0) / 3600, 1),
+        "late_count": int(row.late_count or 0),
+    }
+
+
+def employee_month_summary(emp_id, year, month):
+    start, end = month_range(year, month)
+    att = with_archive(AttendanceDB, start)
+    row = (
+        db.session.query(*attendance_summary_columns(att))
+        .filter(att.employee_id == emp_id, att.date >= start, att.date < end)
+        .one()
+    )
+    return _summary_dict(row)
+
+
+def staff_month_summary(branch_id, year, month):
+    """Rekap seluruh karyawan 1 cabang untuk 1 bulan dalam 1 query (LEFT JOIN + GROUP BY)."""
+    start, end = month_range(year, month)
+    att = with_archive(AttendanceDB, start)
+    rows = (
+        db.session.query(EmployeeDB.id, EmployeeDB.name, EmployeeDB.position, EmployeeDB.status,
+                         *attendance_summary_columns(att))
+        .outerjoin(att, and_(
+            att.employee_id == EmployeeDB.id,
+            att.date >= start,
+            att.date < end,
+        ))
+        .filter(EmployeeDB.branch_id == branch_id)
+        .group_by(EmployeeDB.id, EmployeeDB.name, EmployeeDB.position, EmployeeDB.status)
+        .order_by(EmployeeDB.name.asc())
+        .all()
+    )
+    return [
+        dict(id=r.id, name=r.name, position=r.position, status=r.status, **_summary_dict(r))
+        for r in rows
+    ]
+
+
+# ---------------------------------------------------------------------------
+# Analitik pendapatan (GROUP BY di database)
+# ---------------------------------------------------------------------------
+app.config.setdefault("QUERY_CACHE_MAX_ENTRIES", 512)
+app.config.setdefault("QUERY_CACHE_MAX_BYTES", 4 * 1024 * 1024)  # 4 MB
+
+# hasil query disimpan sebagai JSON string, jadi LRU yang sama bisa dipakai
+query_cache = FragmentCache(
+    app.config["QUERY_CACHE_MAX_ENTRIES"],
+    app.config["QUERY_CACHE_MAX_BYTES"],
+)
+
+ANALYTICS_DIMENSIONS = ("service", "employee", "sparepart")
+ANALYTICS_PERIODS = ("day", "week", "month", "year")
+ANALYTICS_TOP_MAX = 100
+
+_PERIOD_FORMATS = {
+    # (MySQL DATE_FORMAT, SQLite strftime)
+    "day": ("%Y-%m-%d", "%Y-%m-%d"),
+    "week": ("%x-W%v", "%Y-W%W"),
+    "month": ("%Y-%m", "%Y-%m"),
+    "year": ("%Y", "%Y"),
+}
+
+
+def period_bucket(column, granularity):
+    """Ekspresi SQL label periode (hari/minggu/bulan/tahun) untuk kolom tanggal."""
+    mysql_fmt, sqlite_fmt = _PERIOD_FORMATS[granularity]
+    if db.engine.dialect.name == "mysql":
+        return func.date_format(column, mysql_fmt)
+    return func.strftime(sqlite_fmt, column)
+
+
+def cached_query(key, models, compute):
+    """Cache hasil query (harus bisa di-JSON-kan) sampai tabel terkait berubah."""
+    full_key = (key, data_version(*models))
+    cached = query_cache.get(full_key)
+    if cached is not None:
+        return json.loads(cached)
+    result = compute()
+    query_cache.set(full_key, json.dumps(result))
+    return result
+
+
+def analytics_query(branch_id, group_by, date_from, date_to, top=None):
+    """
+    Pendapatan & jumlah job 1 cabang dikelompokkan per layanan / karyawan /
+    sparepart atau per periode, untuk rentang tanggal [date_from, date_to].
+    """
+    def compute():
+        if group_by == "sparepart":
+            items = with_archive(TransactionItemDB, date_from)
+            revenue = func.sum(items.qty * items.unit_price)
+            query = (
+                db.session.query(
+                    SparepartDB.name.label("label"),
+                    revenue.label("revenue"),
+                    func.count(func.distinct(items.transaction_id)).label("jobs"),
+                    func.sum(items.qty).label("qty"),
+                )
+                .join(SparepartDB, SparepartDB.id == items.sparepart_id)
+                .filter(
+                    items.branch_id == branch_id,
+                    items.date >= date_from,
+                    items.date <= date_to,
+                )
+                .group_by(SparepartDB.id, SparepartDB.name)
+                .order_by(revenue.desc())
+            )
+        else:
+            trx = with_archive(TransactionDB, date_from)
+            if group_by == "service":
+                label = trx.service_name
+            elif group_by == "employee":
+                label = func.coalesce(trx.employee_name, "Belum ditugaskan")
+            else:
+                label = period_bucket(trx.date, group_by)
+            revenue = func.sum(trx.total)
+            query = (
+                db.session.query(
+                    label.label("label"),
+                    func.coalesce(revenue, 0).label("revenue"),
+                    func.count(trx.id).label("jobs"),
+                )
+                .filter(
+                    trx.branch_id == branch_id,
+                    trx.date >= date_from,
+                    trx.date <= date_to,
+                )
+                .group_by(label)
+            )
+            query = query.order_by(label.asc()) if group_by in ANALYTICS_PERIODS else query.order_by(revenue.desc())
+
+        if top and group_by not in ANALYTICS_PERIODS:
+            query = query.limit(top)
+        return [
+            {
+                "label": str(r.label) if r.label is not None else "-",
+                "revenue": float(r.revenue or 0),
+                "jobs": int(r.jobs or 0),
+                **({"qty": int(r.qty or 0)} if group_by == "sparepart" else {}),
+            }
+            for r in query.all()
+        ]
+
+    key = ("analytics", branch_id, group_by, date_from.isoformat(), date_to.isoformat(), top)
+    return cached_query(key, (TransactionDB, TransactionItemDB), compute)
+
+
+SERIES_DEFAULT_POINTS = 120
+SERIES_MAX_POINTS = 1000
+
+
+def period_label(day, granularity):
+    """Label periode sebuah tanggal di Python, sama dengan hasil period_bucket() di SQL."""
+    if granularity == "week" and db.engine.dialect.name == "mysql":
+        return day.strftime("%G-W%V")   # %x-W%v MySQL = minggu ISO
+    return day.strftime(_PERIOD_FORMATS[granularity][1])
+
+
+def iter_period_labels(date_from, granularity):
+    """Label periode berurutan mulai date_from (tidak berhenti sendiri)."""
+    day = date_from
+    last = None
+    while True:
+        label = period_label(day, granularity)
+        if label != last:
+            yield label
+            last = label
+        day += timedelta(days=1)
+
+
+def fill_series(rows, date_from, date_to, granularity, pad_to_multiple=1):
+    """
+    Deret lengkap untuk [date_from, date_to]: periode tanpa transaksi (tidak
+    muncul di GROUP BY) diisi 0. Kalau pad_to_multiple > 1, periode sesudah
+    date_to (juga 0) ditambahkan sampai jumlahnya kelipatan pad_to_multiple.
+    """
+    by_label = {r["label"]: r for r in rows}
+    last_label = period_label(date_to, granularity)
+    labels = []
+    for label in iter_period_labels(date_from, granularity):
+        labels.append(label)
+        if label == last_label:
+            break
+    if pad_to_multiple > 1:
+        extra = iter_period_labels(date_to, granularity)
+        next(extra)  # periode date_to sendiri sudah ada
+        while len(labels) % pad_to_multiple:
+            labels.append(next(extra))
+    return [by_label.get(label, {"label": label, "revenue": 0.0, "jobs": 0}) for label in labels]
+
+
+def downsample_series(rows, date_from, date_to, granularity, max_points):
+    """
+    Deret analytics_query per periode -> paling banyak max_points titik.
+    Periode kosong diisi 0 dulu, lalu digabung per jendela dengan jumlah
+    periode yang sama, jadi setiap titik mewakili rentang waktu yang sama.
+    Pendapatan & job dijumlahkan, bukan disampel, jadi total deret tidak berubah.
+    Mengembalikan (titik, jumlah periode per titik).
+    """
+    full = fill_series(rows, date_from, date_to, granularity)
+    size = max(1, -(-len(full) // max_points))
+    if size == 1:
+        return full, 1
+    full = fill_series(rows, date_from, date_to, granularity, pad_to_multiple=size)
+    merged = []
+    for i in range(0, len(full), size):
+        chunk = full[i:i + size]
+        merged.append({
+            "label": chunk[0]["label"],
+            "label_end": chunk[-1]["label"],
+            "revenue": sum(r["revenue"] for r in chunk),
+            "jobs": sum(r["jobs"] for r in chunk),
+        })
+    return merged, size
+
+
+def transaction_status_counts(branch_id):
+    """{status: jumlah transaksi} 1 cabang (ix_transactions_branch_status)."""
+    return dict(
+        db.session.query(TransactionDB.status, func.count(TransactionDB.id))
+        .filter(TransactionDB.branch_id == branch_id)
+        .group_by(TransactionDB.status)
+        .all()
+    )
+
+
+def month_daily_chart(branch_id, today=None):
+    """Label (tanggal) & pendapatan per hari bulan berjalan untuk chart dashboard."""
+    today = today or date.today()
+    start, end = month_range(today.year, today.month)
+    rows = analytics_query(branch_id, "day", start, end - timedelta(days=1))
+    return [str(int(r["label"][-2:])) for r in rows], [r["revenue"] for r in rows]
+
+
+def parse_date_range(args, default_days=365):
+    """date_from/date_to dari query string (default: `default_days` hari terakhir). Raise ValueError."""
+    today = date.today()
+    try:
+        date_to = datetime.strptime(args["date_to"], "%Y-%m-%d").date() if args.get("date_to") else today
+        date_from = datetime.strptime(args["date_from"], "%Y-%m-%d").date() \
+            if args.get("date_from") else date_to - timedelta(days=default_days)
+    except ValueError:
+        raise ValueError("Format tanggal tidak valid (YYYY-MM-DD).")
+    if date_from > date_to:
+        raise ValueError("Tanggal awal harus sebelum tanggal akhir.")
+    return date_from, date_to
+
+
+def parse_analytics_args(args):
+    """Ambil & validasi parameter analitik dari query string. Raise ValueError."""
+    group_by = args.get("group_by", "service")
+    if group_by not in ANALYTICS_DIMENSIONS + ANALYTICS_PERIODS:
+        raise ValueError("group_by tidak dikenal.")
+    date_from, date_to = parse_date_range(args)
+    top = args.get("top", type=int)
+    if top is not None:
+        top = max(1, min(top, ANALYTICS_TOP_MAX))
+    return group_by, date_from, date_to, top
+
+
+# ---------------------------------------------------------------------------
+# Arsip data lama (`flask --app app archive-old-data`)
+# ---------------------------------------------------------------------------
+import click
+from sqlalchemy import select, union_all
+from sqlalchemy.orm import aliased
+
+app.config.setdefault("ARCHIVE_AFTER_MONTHS", 24)
+ARCHIVE_BATCH_SIZE = 1000
+
+
+def _archive_table(model, *indexes):
+    """Salinan kolom tabel hot tanpa foreign key (baris arsip tidak boleh menahan delete user/layanan)."""
+    return db.Table(
+        f"{model.__tablename__}_archive",
+        *[db.Column(c.name, c.type, primary_key=c.primary_key, autoincrement=False, nullable=c.nullable,
+                    server_default=c.server_default.arg if c.server_default is not None else None)
+          for c in model.__table__.columns],
+        *indexes,
+    )
+
+
+ARCHIVE_TABLES = {
+    TransactionDB: _archive_table(
+        TransactionDB,
+        db.Index("ix_transactions_archive_branch_date", "branch_id", "date", "total"),
+        db.Index("ix_transactions_archive_date", "date"),
+        db.Index("ix_transactions_archive_customer_date", "customer_id", "date"),
+        db.Index("ix_transactions_archive_vehicle_date", "vehicle_id", "date"),
+    ),
+    TransactionItemDB: _archive_table(
+        TransactionItemDB,
+        db.Index("ix_transaction_items_archive_trx", "transaction_id"),
+        db.Index("ix_transaction_items_archive_branch_sparepart_date", "branch_id", "sparepart_id", "date", "qty"),
+        db.Index("ix_transaction_items_archive_date", "date"),
+    ),
+    BookingDB: _archive_table(
+        BookingDB,
+        db.Index("ix_bookings_archive_branch_date", "branch_id", "date"),
+    ),
+    BookingItemDB: _archive_table(
+        BookingItemDB,
+        db.Index("ix_booking_items_archive_booking", "booking_id"),
+    ),
+    AttendanceDB: _archive_table(
+        AttendanceDB,
+        db.Index("ix_attendance_archive_employee_date", "employee_id", "date"),
+        db.Index("ix_attendance_archive_branch_date", "branch_id", "date"),
+        db.Index("ix_attendance_archive_date", "date"),
+    ),
+}
+
+
+def archive_cutoff(months=None, today=None):
+    """
+    Tanggal 1 bulan ke-`months` ke belakang (default app.config["ARCHIVE_AFTER_MONTHS"]);
+    data sebelum tanggal ini boleh diarsipkan.
+    """
+    if months is None:
+        months = app.config["ARCHIVE_AFTER_MONTHS"]
+    today = today or date.today()
+    year, month = shift_month(today.year, today.month, -months)
+    return date(year, month, 1)
+
+
+def with_archive(model, start=None):
+    """
+    `model` apa adanya, atau alias "tabel hot UNION ALL tabel arsip" kalau arsip
+    punya data pada/sesudah `start` (None = tanpa batas awal). Pengecekannya
+    1 query MAX(date) lewat index, jadi laporan periode baru tetap hanya membaca tabel hot.
+    Alias hanya untuk dibaca (laporan), jangan diubah lalu di-commit.
+    """
+    archive = ARCHIVE_TABLES[model]
+    newest = db.session.query(func.max(archive.c.date)).scalar()
+    if newest is None or (start is not None and newest < start):
+        return model
+    hot = model.__table__
+    union = union_all(
+        select(*hot.columns),
+        select(*[archive.c[c.name] for c in hot.columns]),
+    ).subquery(f"{hot.name}_all")
+    return aliased(model, union)
+
+
+def _move_to_archive(model, condition):
+    """INSERT ... SELECT ke tabel arsip lalu DELETE dari tabel hot (dalam transaksi session)."""
+    hot = model.__table__
+    names = [c.name for c in hot.columns]
+    db.session.execute(ARCHIVE_TABLES[model].insert().from_select(names, select(*hot.columns).where(condition)))
+    db.session.execute(delete(hot).where(condition))
+
+
+def _archive_in_batches(model, filters, children=(), batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Pindahkan baris `model` yang cocok dengan `filters` per batch (1 commit per batch
+    supaya lock tidak lama). `children`: pasangan (model anak, kolom FK ke model).
+    Baris dengan id terbesar tidak dipindah supaya auto-increment tidak memakai ulang id arsip.
+    """
+    newest_id = db.session.query(func.max(model.id)).scalar()
+    if newest_id is None:
+        return 0
+    moved = 0
+    while True:
+        ids = [row[0] for row in db.session.query(model.id)
+               .filter(*filters, model.id < newest_id)
+               .order_by(model.id)
+               .limit(batch_size)]
+        if not ids:
+            return moved
+        for child, fk in children:
+            _move_to_archive(child, fk.in_(ids))
+        _move_to_archive(model, model.id.in_(ids))
+        mark_tables_changed(model.__tablename__, *(child.__tablename__ for child, _ in children))
+        db.session.commit()
+        moved += len(ids)
+
+
+def archive_old_data(months=None, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Arsipkan transaksi, booking, dan presensi sebelum archive_cutoff(months).
+    Snapshot laporan bulanan dibuat dulu untuk setiap bulan yang akan diarsipkan,
+    jadi ringkasan bulan lama tetap dibaca dari report_snapshots.
+    Transaksi yang masih terbuka (Proses / Menunggu Sparepart) tetap di tabel hot.
+    """
+    cutoff = archive_cutoff(months)
+    trx_filters = [TransactionDB.date < cutoff, TransactionDB.status.notin_(OPEN_JOB_STATUSES)]
+    months_to_archive = (
+        db.session.query(TransactionDB.branch_id, period_bucket(TransactionDB.date, "month"))
+        .filter(*trx_filters)
+        .distinct()
+        .all()
+    )
+    for branch_id, period in months_to_archive:
+        year, month = (int(part) for part in period.split("-"))
+        get_month_summary(branch_id, year, month)
+
+    moved = {
+        "transactions": _archive_in_batches(
+            TransactionDB, trx_filters, [(TransactionItemDB, TransactionItemDB.transaction_id)], batch_size
+        ),
+        "bookings": _archive_in_batches(
+            BookingDB, [BookingDB.date < cutoff], [(BookingItemDB, BookingItemDB.booking_id)], batch_size
+        ),
+        "attendance": _archive_in_batches(AttendanceDB, [AttendanceDB.date < cutoff], batch_size=batch_size),
+    }
+    # slot booking hari yang sudah lewat tidak dipakai lagi
+    db.session.execute(delete(BookingSlotDB.__table__).where(BookingSlotDB.date < cutoff))
+    db.session.commit()
+    return cutoff, moved
+
+
+@app.cli.command("archive-old-data")
+@click.option("--months", type=int, default=None,
+              help="umur data (bulan) yang diarsipkan  [default: ARCHIVE_AFTER_MONTHS di app.config]")
+@click.option("--batch-size", default=ARCHIVE_BATCH_SIZE, show_default=True)
+def archive_old_data_command(months, batch_size):
+    """Pindahkan transaksi, booking, dan presensi lama ke tabel *_archive."""
+    cutoff, moved = archive_old_data(months, batch_size)
+    click.echo(f"Data sebelum {cutoff.isoformat()} diarsipkan: "
+               + ", ".join(f"{name} {count}" for name, count in moved.items()))
+
+
+# ---------------------------------------------------------------------------
+# Audit log: dicatat saat flush, ditulis batch oleh thread latar belakang
+# ---------------------------------------------------------------------------
+import atexit
+import queue
+import time
+from flask import has_request_context
+
+app.config.setdefault("AUDIT_BATCH_SIZE", 200)
+app.config.setdefault("AUDIT_FLUSH_SECONDS", 1.0)   # batch ditulis paling lambat tiap 1 detik
+app.config.setdefault("AUDIT_QUEUE_MAX", 10000)
+
+# kolom yang dicatat perubahannya: {model: {kolom: nama field di log}}
+AUDITED_FIELDS = {
+    "transactions": {"status": "status", "employee_name": "employee", "total": "total"},
+    "branch_stock": {"stock": "stock"},
+}
+
+
+def _audit_actor():
+    if has_request_context():
+        return session.get("user_id"), session.get("username")
+    return None, "system"
+
+
+def _audit_value(value):
+    return None if value is None else str(value)[:255]
+
+
+def audit_event(entity, entity_id, action, field=None, old=None, new=None, branch_id=None, db_session=None):
+    """
+    Catat 1 event ke session database aktif (atau `db_session`). Event baru
+    dikirim ke writer setelah commit; kalau rollback, event ikut dibuang.
+    """
+    user_id, username = _audit_actor()
+    (db_session or db.session).info.setdefault("audit_events", []).append({
+        "created_at": datetime.now(),
+        "branch_id": branch_id,
+        "user_id": user_id,
+        "username": username,
+        "entity": entity,
+        "entity_id": entity_id,
+        "action": action,
+        "field": field,
+        "old_value": _audit_value(old),
+        "new_value": _audit_value(new),
+    })
+
+
+def _audit_target(obj):
+    """(entity, entity_id) untuk objek yang diaudit."""
+    if isinstance(obj, TransactionDB):
+        return "transaction", obj.id
+    return "sparepart", obj.sparepart_id
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_audit_events(session, flush_context):
+    for obj in session.new:
+        fields = AUDITED_FIELDS.get(getattr(obj, "__tablename__", None))
+        if fields:
+            entity, entity_id = _audit_target(obj)
+            for column, field in fields.items():
+                if getattr(obj, column) is not None:
+                    audit_event(entity, entity_id, "create", field, None, getattr(obj, column),
+                                branch_id=obj.branch_id, db_session=session)
+    for obj in session.dirty:
+        fields = AUDITED_FIELDS.get(getattr(obj, "__tablename__", None))
+        if not fields or not session.is_modified(obj):
+            continue
+        state = sa_inspect(obj)
+        entity, entity_id = _audit_target(obj)
+        for column, field in fields.items():
+            history = state.attrs[column].history
+            if not history.has_changes():
+                continue
+            old = history.deleted[0] if history.deleted else None
+            new = history.added[0] if history.added else None
+            if old != new:
+                audit_event(entity, entity_id, "update", field, old, new,
+                            branch_id=obj.branch_id, db_session=session)
+    for obj in session.deleted:
+        if isinstance(obj, TransactionDB):
+            audit_event("transaction", obj.id, "delete", "status", obj.status, None,
+                        branch_id=obj.branch_id, db_session=session)
+
+
+@event.listens_for(Session, "after_commit")
+def _enqueue_audit_events(session):
+    events = session.info.pop("audit_events", None)
+    if events:
+        audit_writer.submit(events)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_audit_events(session):
+    session.info.pop("audit_events", None)
+
+
+class AuditWriter:
+    """
+    Thread latar belakang yang mengambil event dari antrean dan menulisnya
+    dengan 1 INSERT banyak baris per batch, jadi request tidak menunggu
+    penulisan log.
+    """
+
+    def __init__(self, batch_size, flush_seconds, max_queue):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, events):
+        self._ensure_started()
+        for ev in events:
+            try:
+                self._queue.put_nowait(ev)
+            except queue.Full:
+                # antrean penuh: tulis langsung supaya log tidak hilang
+                self._write([ev])
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._write(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _write(self, batch):
+        try:
+            with app.app_context():
+                with db.engine.begin() as conn:
+                    conn.execute(AuditLogDB.__table__.insert(), batch)
+        except Exception:
+            app.logger.exception("Gagal menulis %d event audit log", len(batch))
+
+    def flush(self):
+        """Tunggu sampai semua event di antrean sudah ditulis."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+
+audit_writer = AuditWriter(
+    app.config["AUDIT_BATCH_SIZE"],
+    app.config["AUDIT_FLUSH_SECONDS"],
+    app.config["AUDIT_QUEUE_MAX"],
+)
+atexit.register(audit_writer.flush)
+
+
+def audit_history(entity, entity_id, branch_id, limit=100):
+    rows = (
+        AuditLogDB.query
+        .filter_by(entity=entity, branch_id=branch_id, entity_id=entity_id)
+        .order_by(AuditLogDB.created_at.desc(), AuditLogDB.id.desc())
+        .limit(limit)
+        .all()
+    )
+    return [
+        {
+            "time": r.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+            "user": r.username,
+            "action": r.action,
+            "field": r.field,
+            "old": r.old_value,
+            "new": r.new_value,
+        }
+        for r in rows
+    ]
+
+
+# ---------------------------------------------------------------------------
+# Jejak status job & kinerja mekanik
+# ---------------------------------------------------------------------------
+JOB_WAITING_PARTS = "Menunggu Sparepart"
+JOB_DONE = "Selesai"
+MECHANIC_METRICS_DAYS = 30
+
+
+def stamp_job_transition(trx, old_status, new_status, now):
+    """Catat waktu keluar/masuk "Menunggu Sparepart" dan waktu selesai (dibuka lagi = dihapus)."""
+    if old_status == JOB_WAITING_PARTS and trx.parts_wait_since is not None:
+        waited = int((now - trx.parts_wait_since).total_seconds())
+        trx.parts_wait_seconds = (trx.parts_wait_seconds or 0) + max(waited, 0)
+        trx.parts_wait_since = None
+    if new_status == JOB_WAITING_PARTS:
+        trx.parts_wait_since = now
+    if new_status == JOB_DONE:
+        trx.completed_at = now
+    elif old_status == JOB_DONE:
+        trx.completed_at = None
+
+
+@event.listens_for(Session, "before_flush")
+def _stamp_job_timestamps(session, flush_context, instances):
+    now = datetime.now()
+    for obj in session.new:
+        if isinstance(obj, TransactionDB):
+            if obj.employee_id is not None and obj.assigned_at is None:
+                obj.assigned_at = now
+            if obj.status:
+                stamp_job_transition(obj, None, obj.status, now)
+    for obj in session.dirty:
+        if not isinstance(obj, TransactionDB):
+            continue
+        attrs = sa_inspect(obj).attrs
+        if attrs.employee_id.history.added and obj.employee_id is not None:
+            obj.assigned_at = now
+        status = attrs.status.history
+        old_status = status.deleted[0] if status.deleted else None
+        if status.added and status.added[0] != old_status:
+            stamp_job_transition(obj, old_status, obj.status, now)
+
+
+def _seconds_between(start, end):
+    if db.engine.dialect.name == "mysql":
+        return func.timestampdiff(text("SECOND"), start, end)
+    return (func.julianday(end) - func.julianday(start)) * 86400
+
+
+def mechanic_metrics(branch_id, date_from, date_to):
+    """
+    Kinerja per mekanik untuk job yang selesai di [date_from, date_to]:
+    job selesai per hari, median waktu penugasan -> selesai, dan total waktu
+    menunggu sparepart. Semua dihitung di database (ix_transactions_branch_completed);
+    median memakai ROW_NUMBER() / COUNT() OVER per karyawan.
+    """
+    def compute():
+        trx = with_archive(TransactionDB, date_from)
+        start = datetime.combine(date_from, datetime.min.time())
+        end = datetime.combine(date_to + timedelta(days=1), datetime.min.time())
+        done = [trx.branch_id == branch_id, trx.employee_id.isnot(None),
+                trx.completed_at >= start, trx.completed_at < end]
+
+        totals = {
+            emp_id: (jobs, wait)
+            for emp_id, jobs, wait in db.session.query(
+                trx.employee_id, func.count(trx.id), func.coalesce(func.sum(trx.parts_wait_seconds), 0)
+            ).filter(*done).group_by(trx.employee_id)
+        }
+
+        duration = _seconds_between(trx.assigned_at, trx.completed_at)
+        ranked = (
+            db.session.query(
+                trx.employee_id.label("emp_id"),
+                duration.label("seconds"),
+                func.row_number().over(partition_by=trx.employee_id, order_by=duration).label("rn"),
+                func.count().over(partition_by=trx.employee_id).label("cnt"),
+            )
+            .filter(*done, trx.assigned_at.isnot(None))
+            .subquery()
+        )
+        # baris tengah: 1 baris (jumlah ganjil) atau 2 baris (genap) yang dirata-rata
+        medians = dict(
+            db.session.query(ranked.c.emp_id, func.avg(ranked.c.seconds))
+            .filter(ranked.c.rn * 2 >= ranked.c.cnt, ranked.c.rn * 2 <= ranked.c.cnt + 2)
+            .group_by(ranked.c.emp_id)
+            .all()
+        )
+
+        days = (date_to - date_from).days + 1
+        employees = EmployeeDB.query.filter_by(branch_id=branch_id).order_by(EmployeeDB.name.asc()).all()
+        rows = []
+        for emp in employees:
+            jobs, wait = totals.get(emp.id, (0, 0))
+            # sama dengan active_mechanics_query: posisi dibandingkan tanpa beda huruf besar/kecil
+            if not jobs and (emp.status != "Aktif" or (emp.position or "").lower() != "mekanik"):
+                continue
+            median = medians.get(emp.id)
+            rows.append({
+                "id": emp.id,
+                "name": emp.name,
+                "completed_jobs": int(jobs),
+                "jobs_per_day": round(jobs / days, 2),
+                "median_minutes": round(float(median) / 60, 1) if median is not None else None,
+                "parts_wait_hours": round(int(wait) / 3600, 1),
+                "avg_parts_wait_minutes": round(int(wait) / jobs / 60, 1) if jobs else 0,
+            })
+        return rows
+
+    key = ("mechanic_metrics", branch_id, date_from.isoformat(), date_to.isoformat())
+    return cached_query(key, (TransactionDB, EmployeeDB), compute)
+
 
-    user = db.relationship("UserDB")
+# ---------------------------------------------------------------------------
+# Booking -> transaksi (satu per satu atau massal dalam 1 transaksi database)
+# ---------------------------------------------------------------------------
+from sqlalchemy.orm import selectinload
 
-class BookingDB(db.Model):
-    __tablename__ = "bookings"
-    id = db.Column(db.Integer, primary_key=True)
-    customer_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
-    date = db.Column(db.Date, nullable=False)
-    time = db.Column(db.Time, nullable=False)
-    service_id = db.Column(db.Integer, db.ForeignKey("services.id"), nullable=False)
-    note = db.Column(db.Text)
-    status = db.Column(db.String(50), default="Menunggu Konfirmasi")
+BOOKING_CONVERTED = "Sudah dibuat transaksi"
+BOOKING_BATCH_MAX = 100
 
-    customer = db.relationship("UserDB")
-    service = db.relationship("ServiceDB")
 
-class BookingItemDB(db.Model):
-    __tablename__ = "booking_items"
-    id = db.Column(db.Integer, primary_key=True)
-    booking_id = db.Column(db.Integer, db.ForeignKey("bookings.id"), nullable=False)
-    sparepart_id = db.Column(db.Integer, db.ForeignKey("spareparts.id"), nullable=False)
-    qty = db.Column(db.Integer, nullable=False, default=1)
+def convert_bookings(branch_id, booking_ids):
+    """
+    Buat TransactionDB untuk setiap booking dan kurangi stok cabang, semuanya 1 commit.
+    Stok semua sparepart yang dibutuhkan dikunci sekaligus dengan 1 query
+    (SELECT ... FOR UPDATE, urut sparepart_id supaya tidak deadlock), lalu booking
+    diproses sesuai urutan id; booking yang stoknya tidak cukup dilewati.
+    Hasil per booking (urut id): {"booking_id", "ok", "message", "transaction_id"}.
+    Booking di atas BOOKING_BATCH_MAX (id terbesar) tidak diproses dan tetap dilaporkan.
+    """
+    booking_ids = sorted(set(booking_ids))
+    booking_ids, over_limit = booking_ids[:BOOKING_BATCH_MAX], booking_ids[BOOKING_BATCH_MAX:]
+    bookings = {
+        b.id: b
+        for b in BookingDB.query
+        .options(
+            selectinload(BookingDB.items).selectinload(BookingItemDB.sparepart),
+            selectinload(BookingDB.customer),
+            selectinload(BookingDB.service),
+        )
+        .filter(BookingDB.branch_id == branch_id, BookingDB.id.in_(booking_ids))
+        .with_for_update()
+        .all()
+    }
+    needed = {item.sparepart_id for b in bookings.values() for item in b.items}
+    stock_rows = {
+        row.sparepart_id: row
+        for row in BranchStockDB.query
+        .filter(BranchStockDB.branch_id == branch_id, BranchStockDB.sparepart_id.in_(needed))
+        .order_by(BranchStockDB.sparepart_id)
+        .with_for_update()
+        .all()
+    } if needed else {}
+
+    results = []
+    created = []
+    for bid in booking_ids:
+        booking = bookings.get(bid)
+        if booking is None:
+            results.append({"booking_id": bid, "ok": False, "message": "Data booking tidak ditemukan."})
+            continue
+        if booking.status == BOOKING_CONVERTED:
+            results.append({"booking_id": bid, "ok": False, "message": "Booking sudah dibuat transaksi."})
+            continue
 
-    booking = db.relationship("BookingDB", backref="items")
-    sparepart = db.relationship("SparepartDB")
+        spare_lines = []
+        for item in booking.items:
+            if item.sparepart and (item.qty or 0) > 0:
+                spare_lines.append((item.sparepart, item.qty, item.sparepart.price))
+        short = next(
+            (spare for spare, qty, _ in spare_lines
+             if stock_rows.get(spare.id) is None or (stock_rows[spare.id].stock or 0) < qty),
+            None,
+        )
+        if short is not None:
+            results.append({"booking_id": bid, "ok": False, "message": f"Stok {short.name} tidak cukup."})
+            continue
 
-class AttendanceDB(db.Model):
-    __tablename__ = "attendance"
-    id = db.Column(db.Integer, primary_key=True)
-    employee_id = db.Column(db.Integer, db.ForeignKey("employees.id"), nullable=False)
-    date = db.Column(db.Date, nullable=False)
-    check_in = db.Column(db.Time)
-    check_out = db.Column(db.Time)
+        for spare, qty, _ in spare_lines:
+            stock_rows[spare.id].stock = (stock_rows[spare.id].stock or 0) - qty
+        service = booking.service
+        service_price = service.price if service else 0
+        total_spare_price = sum(qty * price for _, qty, price in spare_lines)
+        trx = TransactionDB(
+            branch_id=booking.branch_id,
+            date=booking.date,
+            customer_id=booking.customer_id,
+            customer_username=booking.customer.username,
+            customer=booking.customer.full_name or booking.customer.username,
+            service_id=service.id if service else None,
+            service_name=service.name if service else "",
+            sparepart_name=", ".join(f"{spare.name} x{qty}" for spare, qty, _ in spare_lines),
+            price_service=service_price,
+            price_spare=total_spare_price,
+            total=service_price + total_spare_price,
+            status="Proses",
+            vehicle_id=booking.vehicle_id,
+        )
+        set_transaction_items(trx, spare_lines)
+        db.session.add(trx)
+        booking.status = BOOKING_CONVERTED
+        result = {"booking_id": bid, "ok": True, "message": "Transaksi dibuat."}
+        results.append(result)
+        created.append((result, trx))
+
+    db.session.flush()
+    for result, trx in created:
+        result["transaction_id"] = trx.id
+    db.session.commit()
+    results.extend(
+        {"booking_id": bid, "ok": False,
+         "message": f"Dilewati: melebihi batas {BOOKING_BATCH_MAX} booking per proses."}
+        for bid in over_limit
+    )
+    return results
 
-    employee = db.relationship("EmployeeDB")
 
-from datetime import date, timedelta
-from sqlalchemy import func
+# ---------------------------------------------------------------------------
+# Penugasan otomatis (load balancing mekanik)
+# ---------------------------------------------------------------------------
+import heapq
 
-LEAD_TIME_DAYS = 4  # asumsi lead time sama untuk semua sparepart
+OPEN_JOB_STATUSES = ("Proses", "Menunggu Sparepart")
 
-def get_daily_usage(sparepart_id, days_back=30):
-    today = date.today()
-    start_date = today - timedelta(days=days_back)
 
-    rows = (
-        db.session.query(
-            TransactionDB.date.label("d"),
-            func.count(TransactionDB.id).label("qty")  # 1 transaksi = 1 pemakaian sparepart
+def distribute_jobs(job_ids, workloads):
+    """
+    Bagi job ke karyawan dengan beban paling sedikit.
+    workloads: {emp_id: jumlah job terbuka}. Hasil: {job_id: emp_id}.
+    Memakai min-heap, jadi O(j log e) untuk j job dan e karyawan.
+    """
+    heap = [(load, emp_id) for emp_id, load in workloads.items()]
+    heapq.heapify(heap)
+    assignment = {}
+    if not heap:
+        return assignment
+    for job_id in job_ids:
+        load, emp_id = heap[0]
+        assignment[job_id] = emp_id
+        heapq.heapreplace(heap, (load + 1, emp_id))
+    return assignment
+
+
+def mechanic_workloads(branch_id, today=None):
+    """
+    Beban kerja mekanik aktif di 1 cabang: jumlah job terbuka + status
+    check-in hari ini. Dihitung dengan 2 query agregat, bukan per karyawan.
+    """
+    today = today or date.today()
+    mechanics = active_mechanics_query(branch_id).order_by(EmployeeDB.id.asc()).all()
+    ids = [e.id for e in mechanics]
+    open_counts = dict(
+        db.session.query(TransactionDB.employee_id, func.count(TransactionDB.id))
+        .filter(TransactionDB.employee_id.in_(ids), TransactionDB.status.in_(OPEN_JOB_STATUSES))
+        .group_by(TransactionDB.employee_id)
+        .all()
+    ) if ids else {}
+    checked_in = {
+        row.employee_id for row in
+        db.session.query(AttendanceDB.employee_id)
+        .filter(
+            AttendanceDB.employee_id.in_(ids),
+            AttendanceDB.date == today,
+            AttendanceDB.check_in.isnot(None),
+            AttendanceDB.check_out.is_(None),
         )
+        .all()
+    } if ids else set()
+    return [
+        {
+            "employee": e,
+            "open_jobs": open_counts.get(e.id, 0),
+            "checked_in": e.id in checked_in,
+        }
+        for e in mechanics
+    ]
+
+
+def auto_assign_jobs(branch_id, today=None):
+    """
+    Tugaskan semua transaksi Proses di 1 cabang yang belum punya karyawan.
+    Kalau ada mekanik yang sedang check-in, hanya mereka yang diberi job;
+    kalau belum ada yang check-in, semua mekanik aktif dipakai.
+    Semua update dikirim sebagai 1 batch dan 1 commit. Baris job dikunci
+    (SELECT ... FOR UPDATE) sampai commit, jadi assign manual yang datang
+    bersamaan menunggu dan tidak tertimpa.
+    """
+    loads = mechanic_workloads(branch_id, today)
+    present = [w for w in loads if w["checked_in"]]
+    pool = present or loads
+    if not pool:
+        return 0
+
+    job_ids = [
+        row.id for row in
+        db.session.query(TransactionDB.id)
         .filter(
-            TransactionDB.sparepart_id == sparepart_id,
-            TransactionDB.date >= start_date
+            TransactionDB.branch_id == branch_id,
+            TransactionDB.status == "Proses",
+            TransactionDB.employee_id.is_(None),
         )
-        .group_by(TransactionDB.date)
+        .order_by(TransactionDB.date.asc(), TransactionDB.id.asc())
+        .with_for_update()
         .all()
-    )
+    ]
+    if not job_ids:
+        return 0
+
+    job_dates = [
+        row.date for row in
+        db.session.query(TransactionDB.date).filter(TransactionDB.id.in_(job_ids)).distinct()
+    ]
+    names = {w["employee"].id: w["employee"].name for w in pool}
+    assignment = distribute_jobs(job_ids, {w["employee"].id: w["open_jobs"] for w in pool})
+    now = datetime.now()
+    db.session.bulk_update_mappings(TransactionDB, [
+        {"id": job_id, "employee_id": emp_id, "employee_name": names[emp_id], "assigned_at": now}
+        for job_id, emp_id in assignment.items()
+    ])
+    # bulk update tidak lewat flush ORM, jadi event audit dicatat manual
+    for job_id, emp_id in assignment.items():
+        audit_event("transaction", job_id, "update", "employee", None, names[emp_id], branch_id=branch_id)
+    invalidate_report_snapshots([(branch_id, d) for d in job_dates])
+    mark_tables_changed(TransactionDB.__tablename__)
+    db.session.commit()
+    return len(assignment)
+
+
+# ---------------------------------------------------------------------------
+# Log query lambat + EXPLAIN (dibaca owner di /owner/slow-queries)
+# ---------------------------------------------------------------------------
+import logging
+import sys
+from logging.handlers import RotatingFileHandler
+
+app.config.setdefault("SLOW_QUERY_MS", 200)   # 0 mematikan pencatatan
+app.config.setdefault("SLOW_QUERY_LOG", os.path.join(app.instance_path, "slow_queries.log"))
+SLOW_QUERY_LOG_BYTES = 5 * 1024 * 1024
+SLOW_QUERY_LOG_BACKUPS = 3
+SLOW_QUERY_VIEW_LIMIT = 200
+_EXPLAINABLE = ("SELECT", "WITH")
+_SLOW_QUERY_INTERNALS = {"_query_origin", "_log_slow_query", "_start_query_timer"}
+
+slow_query_logger = logging.getLogger("bengkel.slow_query")
+slow_query_logger.propagate = False
+slow_query_logger.setLevel(logging.INFO)
+
+
+def _slow_query_handler():
+    if not slow_query_logger.handlers:
+        log_path = app.config["SLOW_QUERY_LOG"]
+        os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+        handler = RotatingFileHandler(
+            log_path, maxBytes=SLOW_QUERY_LOG_BYTES, backupCount=SLOW_QUERY_LOG_BACKUPS, encoding="utf-8"
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        slow_query_logger.addHandler(handler)
+    return slow_query_logger
 
-    usage_by_day = {r.d: int(r.qty) for r in rows}
-    series = []
-    for i in range(days_back):
-        d = start_date + timedelta(days=i)
-        series.append(usage_by_day.get(d, 0))
-    return series
 
+def _param_shape(params):
+    """Tipe parameter saja (nilai tidak dicatat): {"param_1": "int"} / ["date", "date"]."""
+    if isinstance(params, dict):
+        return {k: type(v).__name__ for k, v in params.items()}
+    if isinstance(params, (list, tuple)):
+        return [type(v).__name__ for v in params]
+    return type(params).__name__
 
-def hitung_rop(sparepart_id, days_back=30, lead_time=LEAD_TIME_DAYS):
+
+def _query_origin():
+    """Fungsi di app.py yang memicu query (frame pertama di luar SQLAlchemy & bagian ini)."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        code = frame.f_code
+        if code.co_filename == __file__ and code.co_name not in _SLOW_QUERY_INTERNALS:
+            return f"{code.co_name}:{frame.f_lineno}"
+        frame = frame.f_back
+    return None
+
+
+def _explain(conn, cursor, statement, parameters):
     """
-    Menghitung AU, pemakaian maks, safety stock, dan ROP untuk 1 sparepart.
-    Menggunakan data pemakaian N hari terakhir.
+    Rencana eksekusi lewat cursor DBAPI baru di koneksi yang sama
+    (tidak melewati event SQLAlchemy, jadi tidak tercatat ulang).
     """
-    series = get_daily_usage(sparepart_id, days_back)
-    if not series:
-        return 0, 0, 0, 0  # belum ada data
+    if not statement.lstrip().upper().startswith(_EXPLAINABLE):
+        return None
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+    explain_cursor = cursor.connection.cursor()
+    try:
+        explain_cursor.execute(prefix + statement, parameters)
+        columns = [d[0] for d in explain_cursor.description or ()]
+        return [dict(zip(columns, row)) for row in explain_cursor.fetchall()]
+    except Exception as e:
+        return [{"error": str(e)}]
+    finally:
+        explain_cursor.close()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "handle_error")
+def _drop_query_timer(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start"):
+        conn.info["query_start"].pop()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _log_slow_query(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_start"].pop()
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    threshold_ms = app.config["SLOW_QUERY_MS"]
+    if threshold_ms <= 0 or elapsed_ms < threshold_ms:
+        return
+    entry = {
+        "at": datetime.now().isoformat(timespec="seconds"),
+        "ms": round(elapsed_ms, 1),
+        "route": None,
+        "function": _query_origin(),
+        "statement": statement,
+    }
+    if executemany:
+        entry["params"] = {"rows": len(parameters), "shape": _param_shape(parameters[0]) if parameters else None}
+    else:
+        entry["params"] = _param_shape(parameters)
+        entry["plan"] = _explain(conn, cursor, statement, parameters)
+    if has_request_context():
+        entry["route"] = f"{request.method} {request.url_rule.rule if request.url_rule else request.path}"
+    _slow_query_handler().info(json.dumps(entry, default=str))
+
+
+def read_slow_queries(limit=SLOW_QUERY_VIEW_LIMIT):
+    """Entri terbaru dulu, dari file log aktif lalu file rotasi (.1, .2, ...)."""
+    entries = []
+    log_path = app.config["SLOW_QUERY_LOG"]
+    paths = [log_path] + [f"{log_path}.{n}" for n in range(1, SLOW_QUERY_LOG_BACKUPS + 1)]
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding="utf-8") as f:
+            lines = f.readlines()
+        for line in reversed(lines):
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+            if len(entries) >= limit:
+                return entries
+    return entries
+
+
+def summarize_slow_queries(entries):
+    """Kelompokkan per route + fungsi: mana yang paling sering / paling lama."""
+    groups = {}
+    for e in entries:
+        key = (e.get("route") or "-", e.get("function") or "-")
+        g = groups.setdefault(key, {"route": key[0], "function": key[1], "count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        g["count"] += 1
+        g["total_ms"] += e.get("ms", 0)
+        g["max_ms"] = max(g["max_ms"], e.get("ms", 0))
+    return sorted(groups.values(), key=lambda g: g["total_ms"], reverse=True)
+
+
+# ---------------------------------------------------------------------------
+# Aset statis: nama ber-hash + gzip/brotli (`flask --app app build-assets`)
+# ---------------------------------------------------------------------------
+import gzip
+import hashlib
+import mimetypes
+import posixpath
+import shutil
+from flask import send_from_directory
+
+try:
+    import brotli  # opsional: pip install brotli
+except ImportError:
+    brotli = None
+
+ASSET_DIRS = ("vendor", "css", "js", "fonts", "images")
+ASSET_DIST = "dist"                 # hasil build di static/dist (tidak ikut git)
+ASSET_MANIFEST = "manifest.json"    # nama asli -> nama ber-hash
+COMPRESSIBLE_EXTS = {".css", ".js", ".svg", ".ttf", ".otf", ".eot", ".ico", ".json", ".map", ".txt"}
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+_CSS_URL_RE = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+
+def _dist_dir():
+    return os.path.join(app.static_folder, ASSET_DIST)
+
+
+def load_asset_manifest():
+    try:
+        with open(os.path.join(_dist_dir(), ASSET_MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}  # belum di-build: url_for memakai file asli
+
+
+asset_manifest = load_asset_manifest()
+
+
+def _hashed_name(rel_path, content):
+    root, ext = posixpath.splitext(rel_path)
+    return f"{root}.{hashlib.sha256(content).hexdigest()[:12]}{ext}"
+
+
+def _rewrite_css_urls(css_rel, css_text, manifest):
+    """url(../fonts/x.woff) di CSS diarahkan ke file font/gambar yang sudah ber-hash."""
+    base = posixpath.dirname(css_rel)
+
+    def replace(match):
+        quote, target = match.group(1), match.group(2).strip()
+        if target.startswith(("data:", "http:", "https:", "//", "/", "#")):
+            return match.group(0)
+        cut = min([i for i in (target.find("?"), target.find("#")) if i >= 0], default=len(target))
+        path, suffix = target[:cut], target[cut:]
+        hashed = manifest.get(posixpath.normpath(posixpath.join(base, path)))
+        if hashed is None:
+            return match.group(0)
+        return f"url({quote}{posixpath.relpath(hashed, base)}{suffix}{quote})"
+
+    return _CSS_URL_RE.sub(replace, css_text)
+
+
+def _write_asset(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+    if os.path.splitext(path)[1].lower() not in COMPRESSIBLE_EXTS:
+        return  # woff/jpg/png sudah terkompresi
+    variants = [(".gz", gzip.compress(content, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append((".br", brotli.compress(content, quality=11)))
+    for suffix, data in variants:
+        if len(data) < len(content):
+            with open(path + suffix, "wb") as f:
+                f.write(data)
+
+
+def build_assets():
+    """
+    Salin aset ke static/dist dengan nama ber-hash isi file, plus varian
+    .gz/.br. Mengembalikan manifest {nama asli: nama ber-hash}.
+    """
+    static = app.static_folder
+    dist = _dist_dir()
+    shutil.rmtree(dist, ignore_errors=True)
+    files = []
+    for top in ASSET_DIRS:
+        for dirpath, _, names in os.walk(os.path.join(static, top)):
+            files += [os.path.relpath(os.path.join(dirpath, n), static).replace(os.sep, "/") for n in names]
+    # CSS terakhir: url() di dalamnya menunjuk font/gambar yang sudah di-hash
+    files.sort(key=lambda rel: (rel.endswith(".css"), rel))
+
+    manifest = {}
+    for rel in files:
+        with open(os.path.join(static, rel), "rb") as f:
+            content = f.read()
+        if rel.endswith(".map"):
+            out_rel = rel  # nama asli supaya sourceMappingURL di file .js/.css tetap cocok
+        else:
+            if rel.endswith(".css"):
+                css = content.decode("utf-8", errors="surrogateescape")
+                content = _rewrite_css_urls(rel, css, manifest).encode("utf-8", errors="surrogateescape")
+            out_rel = _hashed_name(rel, content)
+            manifest[rel] = out_rel
+        _write_asset(os.path.join(dist, out_rel), content)
 
-    total = sum(series)
-    n = len(series)
+    with open(os.path.join(dist, ASSET_MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
 
-    avg_usage = total / n                # AU = pemakaian rata-rata
-    max_usage = max(series)             # pemakaian maksimum
-    safety_stock = (max_usage - avg_usage) * lead_time
-    rop = (lead_time * avg_usage) + safety_stock
 
-    # dibulatkan ke atas supaya aman
-    return (
-        round(avg_usage, 2),
-        int(max_usage),
-        int(round(safety_stock)),
-        int(round(rop)),
-    )
+@app.url_defaults
+def fingerprinted_static_url(endpoint, values):
+    """url_for('static', filename=...) otomatis memakai nama ber-hash kalau sudah di-build."""
+    if endpoint == "static" and values.get("filename") in asset_manifest:
+        values["filename"] = f"{ASSET_DIST}/{asset_manifest[values['filename']]}"
 
 
+def serve_static(filename):
+    """
+    File di static/dist: kirim varian .br/.gz sesuai Accept-Encoding dengan
+    cache immutable 1 tahun (isi berubah = nama berubah). File lain seperti biasa.
+    """
+    prefix = ASSET_DIST + "/"
+    if not filename.startswith(prefix):
+        return app.send_static_file(filename)
+    rel = filename[len(prefix):]
+    dist = _dist_dir()
+    mimetype = mimetypes.guess_type(rel)[0] or "application/octet-stream"
+    response = None
+    for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+        if request.accept_encodings.quality(encoding) > 0 and os.path.isfile(os.path.join(dist, rel + suffix)):
+            response = send_from_directory(dist, rel + suffix, mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE)
+            response.headers["Content-Encoding"] = encoding
+            break
+    if response is None:
+        response = send_from_directory(dist, rel, mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE)
+    response.headers["Vary"] = "Accept-Encoding"
+    response.cache_control.immutable = True
+    return response
+
+
+app.view_functions["static"] = serve_static
+
+
+@app.cli.command("build-assets")
+def build_assets_command():
+    """Buat aset statis ber-hash + gzip/brotli di static/dist."""
+    manifest = build_assets()
+    asset_manifest.clear()
+    asset_manifest.update(manifest)
+    note = "" if brotli is not None else " (tanpa .br: modul brotli belum terpasang)"
+    click.echo(f"{len(manifest)} aset dibuat di static/{ASSET_DIST}{note}.")
+
 
 @app.route("/")
 def index():
@@ -195,6 +2628,7 @@ def login():
             session["user_id"] = user.id
             session["username"] = user.username
             session["role"] = user.role
+            session["branch_id"] = user.branch_id or DEFAULT_BRANCH_ID
             if user.role == "owner":
                 return redirect(url_for("owner_dashboard"))
             elif user.role == "admin":
@@ -242,51 +2676,26 @@ def owner_dashboard():
     if session.get("role") != "owner":
         return redirect(url_for("login"))
 
-    employees = EmployeeDB.query.all()
-    spareparts = SparepartDB.query.all()
-    transactions = TransactionDB.query.all()
-
-    # Hitung ROP per sparepart
-    rop_map = {}
-    for sp in spareparts:
-        avg_use, max_use, ss, rop = hitung_rop(sp.id)  # pakai fungsi di atas
-        rop_map[sp.id] = {
-            "avg": avg_use,
-            "max": max_use,
-            "ss": ss,
-            "rop": rop,
-        }
-
-    # Stok rendah berdasarkan ROP: stok <= ROP dan ROP > 0
-    low_stock_list = [
-        sp for sp in spareparts
-        if rop_map.get(sp.id, {}).get("rop", 0) > 0
-        and (sp.stock or 0) <= rop_map[sp.id]["rop"]
-    ]
-
-    today = datetime.today()
-    this_month = (today.year, today.month)
-    last_month = (
-        today.year if today.month > 1 else today.year - 1,
-        today.month - 1 if today.month > 1 else 12,
-    )
+    branch_id = current_branch_id()
+    employees = EmployeeDB.query.filter_by(branch_id=branch_id).all()
 
-    total_this_month = 0
-    total_last_month = 0
-    count_this_month = 0
-    count_last_month = 0
+    # Stok rendah (stok <= ROP dan ROP > 0): flag yang dijaga saat stok/pemakaian berubah
+    low_stock_list = low_stock_rows(branch_id)
 
-    for t in transactions:
-        d = t.date
-        if not d:
-            continue
-        key = (d.year, d.month)
-        if key == this_month:
-            total_this_month += (t.total or 0)
-            count_this_month += 1
-        elif key == last_month:
-            total_last_month += (t.total or 0)
-            count_last_month += 1
+    # total bulan ini & bulan lalu: 2 bucket bulanan dari SQL
+    today = date.today()
+    month_start, next_month = month_range(today.year, today.month)
+    last_month = date(*shift_month(today.year, today.month, -1), 1)
+    monthly = {
+        r["label"]: r
+        for r in analytics_query(branch_id, "month", last_month, next_month - timedelta(days=1))
+    }
+    this_row = monthly.get(month_start.strftime("%Y-%m"), {})
+    last_row = monthly.get(last_month.strftime("%Y-%m"), {})
+    total_this_month = this_row.get("revenue", 0)
+    total_last_month = last_row.get("revenue", 0)
+    count_this_month = this_row.get("jobs", 0)
+    count_last_month = last_row.get("jobs", 0)
 
     revenue_change_pct = (
         (total_this_month - total_last_month) / total_last_month * 100
@@ -299,8 +2708,9 @@ def owner_dashboard():
 
     active_employees = sum(1 for e in employees if (e.status or "") == "Aktif")
     low_stock_items = len(low_stock_list)
-    pending_orders = sum(1 for t in transactions if (t.status or "") == "Proses")
-    completed_orders = sum(1 for t in transactions if (t.status or "") == "Selesai")
+    status_counts = transaction_status_counts(branch_id)
+    pending_orders = status_counts.get("Proses", 0)
+    completed_orders = status_counts.get("Selesai", 0)
 
     stats = {
         "total_transactions": count_this_month,
@@ -313,20 +2723,7 @@ def owner_dashboard():
         "revenue_change_pct": revenue_change_pct,
     }
 
-    chart_labels = []
-    chart_values = []
-    daily = {}
-    for t in transactions:
-        d = t.date
-        if not d:
-            continue
-        if d.year == this_month[0] and d.month == this_month[1]:
-            key = d.day
-            daily[key] = daily.get(key, 0) + (t.total or 0)
-
-    for day in sorted(daily.keys()):
-        chart_labels.append(str(day))
-        chart_values.append(daily[day])
+    chart_labels, chart_values = month_daily_chart(branch_id, today)
 
     return render_template(
         "owner/owner_dashboard.html",
@@ -334,10 +2731,36 @@ def owner_dashboard():
         chart_labels=chart_labels,
         chart_values=chart_values,
         low_stock_list=low_stock_list,
-        rop_map=rop_map,  # kalau mau ditampilkan di template
+        branches=BranchDB.query.order_by(BranchDB.id.asc()).all(),
+        current_branch=BranchDB.query.get(branch_id),
+        branch_message=request.args.get("branch_message"),
     )
 
 
+@app.route("/owner/branch", methods=["POST"])
+def owner_branch():
+    """Pindah cabang aktif atau tambah cabang baru (owner)."""
+    if session.get("role") != "owner":
+        return redirect(url_for("login"))
+    action = request.form.get("action")
+    if action == "switch":
+        branch_id = request.form.get("branch_id", type=int)
+        branch = BranchDB.query.get(branch_id) if branch_id else None
+        if branch:
+            session["branch_id"] = branch.id
+    elif action == "create":
+        name = (request.form.get("name") or "").strip()
+        if not name:
+            return redirect(url_for("owner_dashboard", branch_message="Nama cabang wajib diisi."))
+        if BranchDB.query.filter(db.func.lower(BranchDB.name) == name.lower()).first():
+            return redirect(url_for("owner_dashboard", branch_message="Nama cabang sudah terdaftar."))
+        branch = BranchDB(name=name, address=request.form.get("address") or "")
+        db.session.add(branch)
+        db.session.commit()
+        session["branch_id"] = branch.id
+    return redirect(url_for("owner_dashboard"))
+
+
 
 @app.route("/owner/employees", methods=["GET", "POST"])
 def manage_employees():
@@ -345,11 +2768,12 @@ def manage_employees():
         return redirect(url_for("login"))
     message = None
     edit_employee_data = None
-    employees = EmployeeDB.query.order_by(EmployeeDB.id.asc()).all()
+    branch_id = current_branch_id()
+    employees = EmployeeDB.query.filter_by(branch_id=branch_id).order_by(EmployeeDB.id.asc()).all()
     users = UserDB.query.order_by(UserDB.username.asc()).all()
     edit_id = request.args.get("edit_id", type=int)
     if edit_id:
-        edit_employee_data = EmployeeDB.query.get(edit_id)
+        edit_employee_data = get_in_branch(EmployeeDB, edit_id, branch_id)
     if request.method == "POST":
         action = request.form.get("action")
         if action == "create":
@@ -361,12 +2785,14 @@ def manage_employees():
                 message = "Nama dan posisi wajib diisi."
             else:
                 emp = EmployeeDB(
+                    branch_id=branch_id,
                     name=name,
                     position=position,
                     status=status or "Aktif",
                     user_id=user_id if user_id else None
                 )
                 db.session.add(emp)
+                move_user_to_branch(emp.user_id, branch_id)
                 db.session.commit()
                 return redirect(url_for("manage_employees"))
         elif action == "update":
@@ -375,7 +2801,7 @@ def manage_employees():
             position = request.form.get("position")
             status = request.form.get("status")
             user_id = request.form.get("user_id", type=int)
-            emp = EmployeeDB.query.get(emp_id)
+            emp = get_in_branch(EmployeeDB, emp_id, branch_id)
             if emp is None:
                 message = "Data karyawan tidak ditemukan."
             elif not name or not position:
@@ -385,11 +2811,12 @@ def manage_employees():
                 emp.position = position
                 emp.status = status or "Aktif"
                 emp.user_id = user_id if user_id else None
+                move_user_to_branch(emp.user_id, branch_id)
                 db.session.commit()
                 return redirect(url_for("manage_employees"))
         elif action == "delete":
             emp_id = request.form.get("id", type=int)
-            emp = EmployeeDB.query.get(emp_id)
+            emp = get_in_branch(EmployeeDB, emp_id, branch_id)
             if emp:
                 db.session.delete(emp)
                 db.session.commit()
@@ -419,8 +2846,11 @@ def manage_services():
             name = request.form.get("name")
             price = request.form.get("price", type=float)
             description = request.form.get("description")
+            duration = request.form.get("duration_minutes", type=int)
             if not name or price is None:
                 message = "Nama layanan dan harga wajib diisi."
+            elif duration is not None and duration <= 0:
+                message = "Durasi layanan harus lebih dari 0 menit."
             else:
                 existing = ServiceDB.query.filter(
                     db.func.lower(ServiceDB.name) == name.lower()
@@ -431,7 +2861,8 @@ def manage_services():
                     srv = ServiceDB(
                         name=name,
                         price=price,
-                        description=description or ""
+                        description=description or "",
+                        duration_minutes=duration or 60
                     )
                     db.session.add(srv)
                     db.session.commit()
@@ -441,15 +2872,20 @@ def manage_services():
             name = request.form.get("name")
             price = request.form.get("price", type=float)
             description = request.form.get("description")
+            duration = request.form.get("duration_minutes", type=int)
             srv = ServiceDB.query.get(srv_id)
             if not srv:
                 message = "Data layanan tidak ditemukan."
             elif not name or price is None:
                 message = "Nama layanan dan harga wajib diisi."
+            elif duration is not None and duration <= 0:
+                message = "Durasi layanan harus lebih dari 0 menit."
             else:
                 srv.name = name
                 srv.price = price
                 srv.description = description or ""
+                if duration:
+                    srv.duration_minutes = duration
                 db.session.commit()
                 return redirect(url_for("manage_services"))
         elif action == "delete":
@@ -474,6 +2910,7 @@ def manage_spareparts():
 
     message = None
     edit_spare = None
+    branch_id = current_branch_id()
 
     spareparts = SparepartDB.query.order_by(SparepartDB.id.asc()).all()
     edit_id = request.args.get("edit_id", type=int)
@@ -493,12 +2930,15 @@ def manage_spareparts():
                     db.func.lower(SparepartDB.name) == name.lower()
                 ).first()
                 if existing:
-                    existing.stock = (existing.stock or 0) + stock
+                    row = get_branch_stock(branch_id, existing.id)
+                    row.stock = (row.stock or 0) + stock
                     existing.price = price
                     db.session.commit()
                 else:
-                    part = SparepartDB(name=name, stock=stock, price=price)
+                    part = SparepartDB(name=name, stock=0, price=price)
                     db.session.add(part)
+                    db.session.flush()
+                    db.session.add(BranchStockDB(branch_id=branch_id, sparepart_id=part.id, stock=stock))
                     db.session.commit()
                 return redirect(url_for("manage_spareparts"))
 
@@ -514,7 +2954,7 @@ def manage_spareparts():
                 message = "Nama, stok, dan harga wajib diisi."
             else:
                 sp.name = name
-                sp.stock = stock
+                get_branch_stock(branch_id, sp.id).stock = stock
                 sp.price = price
                 db.session.commit()
                 return redirect(url_for("manage_spareparts"))
@@ -524,31 +2964,29 @@ def manage_spareparts():
             sp = SparepartDB.query.get(sp_id)
             if sp:
                 # sebaiknya cegah hapus jika masih dipakai booking_items
-                used = BookingItemDB.query.filter_by(sparepart_id=sp_id).first()
+                used = BookingItemDB.query.filter_by(sparepart_id=sp_id).first() \
+                    or TransactionItemDB.query.filter_by(sparepart_id=sp_id).first()
                 if used:
-                    message = "Sparepart masih dipakai di booking, tidak bisa dihapus."
+                    message = "Sparepart masih dipakai di booking/transaksi, tidak bisa dihapus."
                 else:
                     db.session.delete(sp)
                     db.session.commit()
             return redirect(url_for("manage_spareparts"))
 
-    # hitung ROP untuk setiap sparepart
-    rop_map = {}
-    for sp in spareparts:
-        au, max_use, ss, rop = hitung_rop(sp.id)
-        rop_map[sp.id] = {
-            "avg": au,
-            "max": max_use,
-            "ss": ss,
-            "rop": rop,
-        }
+    # ROP tersimpan per sparepart (dihitung ulang saat pemakaian berubah / ganti hari)
+    rop_map = stored_rop_map(branch_id)
+
+    today = date.today()
+    usage_map = sparepart_usage_summary(branch_id, today - timedelta(days=30), today + timedelta(days=1))
 
     return render_template(
         "owner/sparepart_manage.html",
         spareparts=spareparts,
+        stock_map=branch_stock_map(branch_id),
         message=message,
         edit_spare=edit_spare,
         rop_map=rop_map,
+        usage_map=usage_map,
     )
 
 
@@ -563,10 +3001,11 @@ def manage_transactions():
     customers = users
     message = None
     edit_trx = None
+    branch_id = current_branch_id()
 
     edit_id = request.args.get("edit_id", type=int)
     if edit_id:
-        edit_trx = TransactionDB.query.get(edit_id)
+        edit_trx = get_in_branch(TransactionDB, edit_id, branch_id)
 
     if request.method == "POST":
         action = request.form.get("action")
@@ -578,7 +3017,8 @@ def manage_transactions():
             spare_id = request.form.get("sparepart", type=int)
             status = request.form.get("status")
 
-            customer_user = next((u for u in customers if u.username == customer_username), None)
+            customer_user = UserDB.query.filter_by(username=customer_username, role="customer").first() \
+                if customer_username else None
             customer_name = customer_user.full_name if customer_user and customer_user.full_name else customer_username
 
             if not date_str or not customer_username or not service_id:
@@ -598,22 +3038,25 @@ def manage_transactions():
                     total = service_price + spare_price
 
                     if spare is not None:
-                        if (spare.stock or 0) <= 0:
+                        spare_stock = get_branch_stock(branch_id, spare.id)
+                        if (spare_stock.stock or 0) <= 0:
                             message = f"Stok {spare_name} sudah habis."
                             return render_template(
                                 "owner/transaction_manage.html",
-                                transactions=TransactionDB.query.order_by(TransactionDB.id.asc()).all(),
+                                transaction_rows=transaction_rows_fragment(branch_id),
                                 services=services,
                                 spareparts=spareparts,
                                 customers=customers,
                                 message=message,
                                 edit_trx=edit_trx,
                             )
-                        spare.stock = (spare.stock or 0) - 1
+                        spare_stock.stock = (spare_stock.stock or 0) - 1
                         db.session.commit()
 
                     trx = TransactionDB(
+                        branch_id=branch_id,
                         date=date_obj,
+                        customer_id=customer_user.id if customer_user else None,
                         customer_username=customer_username,
                         customer=customer_name,
                         service_id=service.id if service else None,
@@ -624,7 +3067,9 @@ def manage_transactions():
                         price_spare=spare_price,
                         total=total,
                         status=status or "Proses",
+                        vehicle=get_or_create_vehicle(request.form.get("plate"), customer_user),
                     )
+                    set_transaction_items(trx, [(spare, 1, spare_price)] if spare else [])
                     db.session.add(trx)
                     db.session.commit()
                     return redirect(url_for("manage_transactions"))
@@ -637,11 +3082,11 @@ def manage_transactions():
             spare_id = request.form.get("sparepart", type=int)
             status = request.form.get("status")
 
-            # di sini customers adalah list objek UserDB, bukan dict
-            customer_user = next((u for u in customers if u.username == customer_username), None)
+            customer_user = UserDB.query.filter_by(username=customer_username, role="customer").first() \
+                if customer_username else None
             customer_name = customer_user.full_name if customer_user and customer_user.full_name else customer_username
 
-            trx = TransactionDB.query.get(trx_id)
+            trx = get_in_branch(TransactionDB, trx_id, branch_id)
 
             if trx is None:
                 message = "Data transaksi tidak ditemukan."
@@ -662,6 +3107,7 @@ def manage_transactions():
                     total = service_price + spare_price
 
                     trx.date = date_obj
+                    trx.customer_id = customer_user.id if customer_user else None
                     trx.customer_username = customer_username
                     trx.customer = customer_name
                     trx.service_id = service.id if service else None
@@ -672,21 +3118,23 @@ def manage_transactions():
                     trx.price_spare = spare_price
                     trx.total = total
                     trx.status = status or "Proses"
+                    if request.form.get("plate"):
+                        trx.vehicle = get_or_create_vehicle(request.form.get("plate"), customer_user)
+                    set_transaction_items(trx, [(spare, 1, spare_price)] if spare else [])
                     db.session.commit()
                     return redirect(url_for("manage_transactions"))
 
         elif action == "delete":
             trx_id = request.form.get("id", type=int)
-            trx = TransactionDB.query.get(trx_id)
+            trx = get_in_branch(TransactionDB, trx_id, branch_id)
             if trx:
                 db.session.delete(trx)
                 db.session.commit()
             return redirect(url_for("manage_transactions"))
 
-    transactions = TransactionDB.query.order_by(TransactionDB.id.asc()).all()
     return render_template(
         "owner/transaction_manage.html",
-        transactions=transactions,
+        transaction_rows=transaction_rows_fragment(branch_id),
         services=services,
         spareparts=spareparts,
         customers=customers,
@@ -702,65 +3150,151 @@ def owner_reports():
         return redirect(url_for("login"))
     month = request.args.get("month", type=int)
     year = request.args.get("year", type=int)
-    all_trx = TransactionDB.query.order_by(TransactionDB.date.desc()).all()
-    if month and year:
-        tx = []
-        for t in all_trx:
-            d = t.date
-            if not d:
-                continue
-            if d.month == month and d.year == year:
-                tx.append(t)
-    else:
-        tx = all_trx
-    total_transaksi = len(tx)
-    total_pendapatan = sum((t.total or 0) for t in tx)
-    layanan_terlaris = {}
-    for t in tx:
-        nama = t.service_name or "-"
-        layanan_terlaris[nama] = layanan_terlaris.get(nama, 0) + 1
-    layanan_terlaris_list = sorted(
-        [{"name": k, "count": v} for k, v in layanan_terlaris.items()],
-        key=lambda x: x["count"],
-        reverse=True
-    )
+    report = build_report(current_branch_id(), month, year,
+                          empty_rows_text="Belum ada data transaksi.",
+                          empty_summary_text="Belum ada data.")
     return render_template(
         "owner/report_manage.html",
-        transactions=tx,
-        total_transaksi=total_transaksi,
-        total_pendapatan=total_pendapatan,
-        layanan_terlaris=layanan_terlaris_list,
         selected_month=month,
-        selected_year=year
+        selected_year=year,
+        **report
+    )
+
+
+@app.route("/owner/attendance")
+def owner_attendance():
+    if session.get("role") != "owner":
+        return redirect(url_for("login"))
+    year, month = parse_month_param(request.args.get("month"))
+    return render_template(
+        "owner/attendance_report.html",
+        summaries=staff_month_summary(current_branch_id(), year, month),
+        selected_month=f"{year:04d}-{month:02d}",
+        prev_month="{:04d}-{:02d}".format(*shift_month(year, month, -1)),
+        next_month="{:04d}-{:02d}".format(*shift_month(year, month, 1)),
+    )
+
+
+@app.route("/owner/mechanics")
+def owner_mechanics():
+    if session.get("role") != "owner":
+        return redirect(url_for("login"))
+    message = None
+    try:
+        date_from, date_to = parse_date_range(request.args, default_days=MECHANIC_METRICS_DAYS - 1)
+    except ValueError as e:
+        message = str(e)
+        date_to = date.today()
+        date_from = date_to - timedelta(days=MECHANIC_METRICS_DAYS - 1)
+    return render_template(
+        "owner/mechanic_metrics.html",
+        rows=mechanic_metrics(current_branch_id(), date_from, date_to),
+        date_from=date_from.strftime("%Y-%m-%d"),
+        date_to=date_to.strftime("%Y-%m-%d"),
+        message=message,
+    )
+
+
+@app.route("/owner/slow-queries")
+def owner_slow_queries():
+    if session.get("role") != "owner":
+        return redirect(url_for("login"))
+    entries = read_slow_queries(request.args.get("limit", SLOW_QUERY_VIEW_LIMIT, type=int))
+    return render_template(
+        "owner/slow_queries.html",
+        entries=entries,
+        summary=summarize_slow_queries(entries),
+        threshold_ms=app.config["SLOW_QUERY_MS"],
+    )
+
+
+@app.route("/owner/analytics")
+def owner_analytics():
+    if session.get("role") != "owner":
+        return redirect(url_for("login"))
+    message = None
+    rows = []
+    try:
+        group_by, date_from, date_to, top = parse_analytics_args(request.args)
+    except ValueError as e:
+        message = str(e)
+        group_by, date_to, top = "service", date.today(), None
+        date_from = date_to - timedelta(days=365)
+    else:
+        rows = analytics_query(current_branch_id(), group_by, date_from, date_to, top)
+    return render_template(
+        "owner/analytics.html",
+        rows=rows,
+        group_by=group_by,
+        date_from=date_from.strftime("%Y-%m-%d"),
+        date_to=date_to.strftime("%Y-%m-%d"),
+        top=top,
+        message=message,
     )
 
 
+@app.route("/api/analytics")
+def analytics_api():
+    if session.get("role") != "owner":
+        return redirect(url_for("login"))
+    try:
+        group_by, date_from, date_to, top = parse_analytics_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({
+        "branch_id": current_branch_id(),
+        "group_by": group_by,
+        "date_from": date_from.strftime("%Y-%m-%d"),
+        "date_to": date_to.strftime("%Y-%m-%d"),
+        "rows": analytics_query(current_branch_id(), group_by, date_from, date_to, top),
+    })
+
+
+@app.route("/api/revenue-series")
+def revenue_series_api():
+    """
+    Deret waktu pendapatan & jumlah job: granularity=day|week|month|year,
+    date_from/date_to (default 1 tahun terakhir), max_points (default 120).
+    """
+    if session.get("role") != "owner":
+        return redirect(url_for("login"))
+    granularity = request.args.get("granularity", "day")
+    if granularity not in ANALYTICS_PERIODS:
+        return jsonify({"error": "granularity harus day, week, month, atau year."}), 400
+    try:
+        date_from, date_to = parse_date_range(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    max_points = max(2, min(request.args.get("max_points", SERIES_DEFAULT_POINTS, type=int), SERIES_MAX_POINTS))
+    branch_id = current_branch_id()
+    rows = analytics_query(branch_id, granularity, date_from, date_to)
+    points, periods_per_point = downsample_series(rows, date_from, date_to, granularity, max_points)
+    return jsonify({
+        "branch_id": branch_id,
+        "granularity": granularity,
+        "date_from": date_from.strftime("%Y-%m-%d"),
+        "date_to": date_to.strftime("%Y-%m-%d"),
+        "periods_per_point": periods_per_point,
+        "points": points,
+    })
+
+
 @app.route("/admin-dashboard")
 def admin_dashboard():
     if session.get("role") != "admin":
         return redirect(url_for("login"))
 
-    employees = EmployeeDB.query.all()
-    spareparts = SparepartDB.query.all()
-    transactions = TransactionDB.query.all()
+    branch_id = current_branch_id()
+    employees = EmployeeDB.query.filter_by(branch_id=branch_id).all()
+    status_counts = transaction_status_counts(branch_id)
 
     total_employees = len(employees)
-    total_spareparts = len(spareparts)
-    total_transactions = len(transactions)
-    open_transactions = sum(1 for t in transactions if (t.status or "") == "Proses")
+    total_spareparts = db.session.query(func.count(SparepartDB.id)).scalar()
+    total_transactions = sum(status_counts.values())
+    open_transactions = status_counts.get("Proses", 0)
 
-    # hitung ROP per sparepart
-    rop_map = {}
-    for sp in spareparts:
-        avg_use, max_use, ss, rop = hitung_rop(sp.id)
-        rop_map[sp.id] = {"avg": avg_use, "max": max_use, "ss": ss, "rop": rop}
-
-    # stok menipis jika stok <= ROP dan ROP > 0
-    low_stock_list = [
-        sp for sp in spareparts
-        if rop_map.get(sp.id, {}).get("rop", 0) > 0
-        and (sp.stock or 0) <= rop_map[sp.id]["rop"]
-    ]
+    # stok menipis (stok <= ROP dan ROP > 0) dibaca dari flag di branch_stock
+    low_stock_list = low_stock_rows(branch_id)
     low_stock_items = len(low_stock_list)
 
     stats = {
@@ -771,99 +3305,90 @@ def admin_dashboard():
         "low_stock_items": low_stock_items,
     }
 
-    # buat data chart transaksi bulan ini (kode lamamu tetap)
-    today = datetime.today()
-    this_month = (today.year, today.month)
-    daily = {}
-    for t in transactions:
-        d = t.date
-        if not d:
-            continue
-        if d.year == this_month[0] and d.month == this_month[1]:
-            key = d.day
-            daily[key] = daily.get(key, 0) + (t.total or 0)
-
-    chart_labels = [str(day) for day in sorted(daily.keys())]
-    chart_values = [daily[day] for day in sorted(daily.keys())]
+    # chart pendapatan harian bulan ini
+    chart_labels, chart_values = month_daily_chart(branch_id)
 
     return render_template(
         "admin/admin_dashboard.html",
         stats=stats,
         low_stock_list=low_stock_list,
-        rop_map=rop_map,
         chart_labels=chart_labels,
         chart_values=chart_values,
     )
 
 
 
+def admin_jobs_fragments(branch_id):
+    def load_transactions():
+        return {
+            "transactions": TransactionDB.query.filter_by(branch_id=branch_id)
+                                               .order_by(TransactionDB.id.asc()).all()
+        }
+
+    def load_open_transactions():
+        return {
+            "transactions": TransactionDB.query.filter(TransactionDB.branch_id == branch_id,
+                                                       TransactionDB.status != "Selesai")
+                                               .order_by(TransactionDB.id.asc()).all()
+        }
+
+    def load_bookings():
+        return {
+            "bookings": BookingDB.query.filter_by(branch_id=branch_id)
+                                       .order_by(BookingDB.date.desc(), BookingDB.time.desc()).all()
+        }
+
+    return {
+        "job_rows": render_fragment(
+            "partials/job_rows.html", (TransactionDB,), load_transactions, branch_id=branch_id
+        ),
+        "job_options": render_fragment(
+            "partials/job_options.html", (TransactionDB,), load_open_transactions, branch_id=branch_id
+        ),
+        "booking_rows": render_fragment(
+            "partials/booking_rows.html",
+            (BookingDB, BookingItemDB, SparepartDB, ServiceDB, UserDB),
+            load_bookings,
+            branch_id=branch_id,
+        ),
+    }
+
+
 @app.route("/admin/jobs", methods=["GET", "POST"])
 def admin_jobs():
     if session.get("role") != "admin":
         return redirect(url_for("login"))
-    employees = EmployeeDB.query.filter_by(status="Aktif").all()
-    transactions = TransactionDB.query.order_by(TransactionDB.id.asc()).all()
-    bookings = BookingDB.query.order_by(BookingDB.date.desc(), BookingDB.time.desc()).all()
-    services = ServiceDB.query.all()
-    spareparts = SparepartDB.query.all()
+    branch_id = current_branch_id()
+    employees = EmployeeDB.query.filter_by(branch_id=branch_id, status="Aktif").all()
     message = None
+    batch_results = None
     active_emps = employees
     if request.method == "POST":
         action = request.form.get("action")
         if action == "create_from_booking":
-            bid = request.form.get("booking_id", type=int)
-            booking = BookingDB.query.get(bid)
-            if booking is None:
-                message = "Data booking tidak ditemukan."
-            else:
-                service = booking.service
-                service_price = service.price if service else 0
-                total_spare_price = 0
-                spare_names = []
-                for item in booking.items:
-                    spare = item.sparepart
-                    qty = item.qty or 0
-                    if not spare or qty <= 0:
-                        continue
-                    if (spare.stock or 0) < qty:
-                        message = f"Stok {spare.name} tidak cukup."
-                        return render_template(
-                            "admin/admin_jobs.html",
-                            employees=active_emps,
-                            transactions=transactions,
-                            bookings=bookings,
-                            message=message
-                        )
-                    spare.stock = (spare.stock or 0) - qty
-                    total_spare_price += spare.price * qty
-                    spare_names.append(f"{spare.name} x{qty}")
-                db.session.commit()
-                spare_text = ", ".join(spare_names) if spare_names else ""
-                total = service_price + total_spare_price
-                trx = TransactionDB(
-                    date=booking.date,
-                    customer_username=booking.customer.username,
-                    customer=booking.customer.full_name or booking.customer.username,
-                    service_id=service.id if service else None,
-                    service_name=service.name if service else "",
-                    sparepart_name=spare_text,
-                    price_service=service_price,
-                    price_spare=total_spare_price,
-                    total=total,
-                    status="Proses",
-                )
-                db.session.add(trx)
-                booking.status = "Sudah dibuat transaksi"
-                db.session.commit()
+            result = convert_bookings(branch_id, [request.form.get("booking_id", type=int)])[0]
+            if result["ok"]:
                 return redirect(url_for("admin_jobs"))
+            message = result["message"]
+        elif action == "create_from_bookings":
+            booking_ids = request.form.getlist("booking_ids", type=int)
+            if not booking_ids:
+                message = "Pilih minimal 1 booking."
+            else:
+                batch_results = convert_bookings(branch_id, booking_ids)
+        elif action == "auto_assign":
+            assigned = auto_assign_jobs(branch_id)
+            if assigned:
+                return redirect(url_for("admin_jobs", assigned=assigned))
+            message = "Tidak ada transaksi yang perlu ditugaskan atau belum ada mekanik aktif."
         elif action == "assign_job":
             trx_id = request.form.get("trx_id", type=int)
             emp_id = request.form.get("emp_id", type=int)
             if not trx_id or not emp_id:
                 message = "Transaksi dan karyawan wajib dipilih."
             else:
-                trx = TransactionDB.query.get(trx_id)
-                emp = EmployeeDB.query.get(emp_id)
+                trx = get_in_branch(TransactionDB, trx_id, branch_id)
+                emp = get_in_branch(EmployeeDB, emp_id, branch_id)
                 if trx is None or emp is None:
                     message = "Data transaksi atau karyawan tidak ditemukan."
                 else:
@@ -873,14 +3398,15 @@ def admin_jobs():
                         trx.status = "Proses"
                     db.session.commit()
                     return redirect(url_for("admin_jobs"))
-    transactions = TransactionDB.query.order_by(TransactionDB.id.asc()).all()
-    bookings = BookingDB.query.order_by(BookingDB.date.desc(), BookingDB.time.desc()).all()
+    assigned = request.args.get("assigned", type=int)
     return render_template(
         "admin/admin_jobs.html",
         employees=active_emps,
-        transactions=transactions,
-        bookings=bookings,
-        message=message
+        message=message,
+        batch_results=batch_results,
+        info=f"{assigned} transaksi berhasil ditugaskan otomatis." if assigned else None,
+        workloads=mechanic_workloads(branch_id),
+        **admin_jobs_fragments(branch_id)
     )
 
 
@@ -889,22 +3415,9 @@ def admin_stock():
     if session.get("role") != "admin":
         return redirect(url_for("login"))
 
-    spareparts = SparepartDB.query.order_by(SparepartDB.name.asc()).all()
+    branch_id = current_branch_id()
     message = None
 
-    # Hitung ROP awal
-    rop_map = {}
-    for sp in spareparts:
-        avg_use, max_use, ss, rop = hitung_rop(sp.id)
-        rop_map[sp.id] = {"avg": avg_use, "max": max_use, "ss": ss, "rop": rop}
-
-    # Stok menipis: stok <= ROP dan ROP > 0
-    low_stock_list = [
-        sp for sp in spareparts
-        if rop_map.get(sp.id, {}).get("rop", 0) > 0
-        and (sp.stock or 0) <= rop_map[sp.id]["rop"]
-    ]
-
     if request.method == "POST":
         action = request.form.get("action")
         sp_id = request.form.get("id", type=int)
@@ -917,26 +3430,22 @@ def admin_stock():
             elif qty is None or qty <= 0:
                 message = "Jumlah restock harus lebih dari 0."
             else:
-                sp.stock = (sp.stock or 0) + qty
+                row = get_branch_stock(branch_id, sp.id)
+                row.stock = (row.stock or 0) + qty
                 db.session.commit()
                 return redirect(url_for("admin_stock"))
 
-    # Reload data setelah kemungkinan restock
     spareparts = SparepartDB.query.order_by(SparepartDB.name.asc()).all()
-    rop_map = {}
-    for sp in spareparts:
-        avg_use, max_use, ss, rop = hitung_rop(sp.id)
-        rop_map[sp.id] = {"avg": avg_use, "max": max_use, "ss": ss, "rop": rop}
-
-    low_stock_list = [
-        sp for sp in spareparts
-        if rop_map.get(sp.id, {}).get("rop", 0) > 0
-        and (sp.stock or 0) <= rop_map[sp.id]["rop"]
-    ]
+    stock_map = branch_stock_map(branch_id)
+    rop_map = stored_rop_map(branch_id)
+
+    # Stok menipis: stok <= ROP dan ROP > 0 (flag di branch_stock)
+    low_stock_list = low_stock_rows(branch_id)
 
     return render_template(
         "admin/admin_stock.html",
         spareparts=spareparts,
+        stock_map=stock_map,
         low_stock_list=low_stock_list,
         rop_map=rop_map,
         message=message,
@@ -950,36 +3459,26 @@ def admin_report():
         return redirect(url_for("login"))
     month = request.args.get("month", type=int)
     year = request.args.get("year", type=int)
-    all_trx = TransactionDB.query.order_by(TransactionDB.date.desc()).all()
-    if month and year:
-        tx = []
-        for t in all_trx:
-            d = t.date
-            if not d:
-                continue
-            if d.month == month and d.year == year:
-                tx.append(t)
-    else:
-        tx = all_trx
-    total_transaksi = len(tx)
-    total_pendapatan = sum((t.total or 0) for t in tx)
-    layanan_terlaris = {}
-    for t in tx:
-        nama = t.service_name or "-"
-        layanan_terlaris[nama] = layanan_terlaris.get(nama, 0) + 1
-    layanan_terlaris_list = sorted(
-        [{"name": k, "count": v} for k, v in layanan_terlaris.items()],
-        key=lambda x: x["count"],
-        reverse=True
-    )
+    report = build_report(current_branch_id(), month, year)
     return render_template(
         "admin/admin_report.html",
-        transactions=tx,
-        total_transaksi=total_transaksi,
-        total_pendapatan=total_pendapatan,
-        layanan_terlaris=layanan_terlaris_list,
         selected_month=month,
-        selected_year=year
+        selected_year=year,
+        **report
+    )
+
+
+@app.route("/admin/vehicles")
+def admin_vehicles():
+    if session.get("role") != "admin":
+        return redirect(url_for("login"))
+    plate = (request.args.get("plate") or "").strip()
+    vehicle, history = vehicle_history(plate)
+    return render_template(
+        "admin/admin_vehicles.html",
+        plate=plate,
+        vehicle=vehicle,
+        history=history,
     )
 
 
@@ -1043,62 +3542,78 @@ def employee_attendance():
         if status not in ("Hadir", "Pulang"):
             message = "Silakan pilih aksi presensi yang benar."
         else:
-            record = AttendanceDB.query.filter_by(
-                employee_id=emp_id,
-                date=today_date
-            ).first()
-            if record is None:
-                record = AttendanceDB(
-                    employee_id=emp_id,
-                    date=today_date
-                )
-                db.session.add(record)
-            if status == "Hadir" and record.check_in is None:
-                record.check_in = now_time
-            elif status == "Pulang":
-                record.check_out = now_time
-            db.session.commit()
+            record_attendance(employee, today_date, status, now_time)
             message = "Presensi berhasil disimpan."
     elif request.method == "POST" and emp_id is None:
         message = "Data karyawan tidak ditemukan. Cek kembali relasi user_id di tabel employees."
-    records = AttendanceDB.query.filter_by(employee_id=emp_id) \
-                                .order_by(AttendanceDB.date.desc()).all() if emp_id else []
+    year, month = parse_month_param(request.args.get("month"))
+    start, end = month_range(year, month)
+    records = AttendanceDB.query.filter(
+        AttendanceDB.employee_id == emp_id,
+        AttendanceDB.date >= start,
+        AttendanceDB.date < end,
+    ).order_by(AttendanceDB.date.desc()).all() if emp_id else []
+    summary = employee_month_summary(emp_id, year, month) if emp_id else None
     return render_template(
         "employee/employee_attendance.html",
         employee=employee,
         records=records,
+        summary=summary,
+        selected_month=f"{year:04d}-{month:02d}",
+        prev_month="{:04d}-{:02d}".format(*shift_month(year, month, -1)),
+        next_month="{:04d}-{:02d}".format(*shift_month(year, month, 1)),
         today=today_str,
         message=message
     )
 
 
+CUSTOMER_TRX_PAGE_SIZE = 20
+
+
 @app.route("/customer-dashboard")
 def customer_dashboard():
     if session.get("role") != "customer":
         return redirect(url_for("login"))
     user_id = session.get("user_id")
     user = UserDB.query.get(user_id)
-    username = user.username if user else None
-    full_name = user.full_name if user and user.full_name else (username or "Customer")
-    if username:
-        my_trx = TransactionDB.query.filter_by(customer_username=username) \
-                                    .order_by(TransactionDB.date.desc()).all()
-    else:
-        my_trx = []
-    total_transaksi = len(my_trx)
-    total_biaya = sum((t.total or 0) for t in my_trx)
-    selesai = sum(1 for t in my_trx if (t.status or "") == "Selesai")
-    proses = sum(1 for t in my_trx if (t.status or "") == "Proses")
+    if user is None:
+        return redirect(url_for("login"))
+    full_name = user.full_name or user.username
+    page = max(1, request.args.get("page", 1, type=int))
+    # riwayat lengkap: transaksi yang sudah diarsipkan ikut dibaca
+    trx = with_archive(TransactionDB)
+    # ambil 1 baris lebih untuk tahu apakah masih ada halaman berikutnya
+    my_trx = (
+        db.session.query(trx).filter(trx.customer_id == user.id)
+        .order_by(trx.date.desc(), trx.id.desc())
+        .offset((page - 1) * CUSTOMER_TRX_PAGE_SIZE)
+        .limit(CUSTOMER_TRX_PAGE_SIZE + 1)
+        .all()
+    )
+    has_next = len(my_trx) > CUSTOMER_TRX_PAGE_SIZE
+    my_trx = my_trx[:CUSTOMER_TRX_PAGE_SIZE]
+    total_transaksi, total_biaya, selesai, proses = (
+        db.session.query(
+            func.count(trx.id),
+            func.coalesce(func.sum(trx.total), 0),
+            func.coalesce(func.sum(case((trx.status == "Selesai", 1), else_=0)), 0),
+            func.coalesce(func.sum(case((trx.status == "Proses", 1), else_=0)), 0),
+        )
+        .filter(trx.customer_id == user.id)
+        .one()
+    )
     stats = {
         "total_transaksi": total_transaksi,
-        "total_biaya": total_biaya,
-        "selesai": selesai,
-        "proses": proses,
+        "total_biaya": total_biaya or 0,
+        "selesai": int(selesai),
+        "proses": int(proses),
     }
     return render_template(
         "customer/customer_dashboard.html",
         stats=stats,
         transactions=my_trx,
+        page=page,
+        has_next=has_next,
         customer_name=full_name,
     )
 
@@ -1109,9 +3624,13 @@ def customer_booking():
         return redirect(url_for("login"))
     services = ServiceDB.query.order_by(ServiceDB.name.asc()).all()
     spareparts = SparepartDB.query.order_by(SparepartDB.name.asc()).all()
+    branches = BranchDB.query.order_by(BranchDB.id.asc()).all()
     user_id = session.get("user_id")
     user = UserDB.query.get(user_id)
     full_name = user.full_name if user and user.full_name else (user.username if user else "Customer")
+    branch_id = request.values.get("branch_id", type=int)
+    if branch_id not in {b.id for b in branches}:
+        branch_id = user.branch_id if user else current_branch_id()
     message = None
     if request.method == "POST":
         date_str = request.form.get("date")
@@ -1133,16 +3652,31 @@ def customer_booking():
                 message = "Format tanggal / waktu tidak valid."
             else:
                 service = ServiceDB.query.filter_by(name=service_name).first()
+                window = slot_window(time_obj, service.duration_minutes) if service else None
+                capacity = active_mechanic_count(branch_id) if window else 0
                 if not service:
                     message = "Layanan tidak ditemukan."
+                elif window is None:
+                    message = "Jam booking di luar jam operasional bengkel."
+                elif capacity <= 0:
+                    message = "Belum ada mekanik aktif, booking belum bisa diterima."
+                elif vehicle_owned_by_other(request.form.get("plate"), user_id):
+                    message = "No. plat tersebut terdaftar atas nama pelanggan lain. Silakan hubungi admin bengkel."
+                elif not reserve_slots(branch_id, date_obj, window[0], window[1], capacity):
+                    db.session.rollback()
+                    message = "Slot pada jam tersebut sudah penuh. Silakan pilih jam lain."
                 else:
                     booking = BookingDB(
+                        branch_id=branch_id,
                         customer_id=user_id,
                         date=date_obj,
                         time=time_obj,
                         service_id=service.id,
                         note=note or "",
-                        status="Menunggu Konfirmasi"
+                        status="Menunggu Konfirmasi",
+                        vehicle=get_or_create_vehicle(request.form.get("plate"), user,
+                                                      vehicle_type=request.form.get("vehicle_type"),
+                                                      only_own=True),
                     )
                     db.session.add(booking)
                     db.session.flush()
@@ -1159,6 +3693,8 @@ def customer_booking():
                             sparepart_id=spare.id,
                             qty=qty
                         ))
+                    if user:
+                        user.branch_id = branch_id   # cabang terakhir jadi default booking berikutnya
                     db.session.commit()
                     message = "Booking berhasil dikirim. Mohon menunggu konfirmasi dari admin."
     return render_template(
@@ -1166,10 +3702,36 @@ def customer_booking():
         customer_name=full_name,
         services=services,
         spareparts=spareparts,
+        branches=branches,
+        branch_id=branch_id,
+        stock_map=branch_stock_map(branch_id),
+        vehicles=VehicleDB.query.filter_by(customer_id=user_id).order_by(VehicleDB.plate.asc()).all(),
         message=message
     )
 
 
+@app.route("/customer/booking/slots")
+def customer_booking_slots():
+    if session.get("role") != "customer":
+        return redirect(url_for("login"))
+    try:
+        day = datetime.strptime(request.args.get("date", ""), "%Y-%m-%d").date()
+    except ValueError:
+        return jsonify({"error": "Format tanggal tidak valid (YYYY-MM-DD)."}), 400
+    service = ServiceDB.query.filter_by(name=request.args.get("service")).first()
+    duration = service.duration_minutes if service else SLOT_MINUTES
+    branch_id = request.args.get("branch_id", type=int)
+    if branch_id is None or BranchDB.query.get(branch_id) is None:
+        user = UserDB.query.get(session.get("user_id"))
+        branch_id = user.branch_id if user else current_branch_id()
+    return jsonify({
+        "branch_id": branch_id,
+        "date": day.strftime("%Y-%m-%d"),
+        "duration_minutes": duration,
+        "slots": available_slots(branch_id, day, duration),
+    })
+
+
 @app.route("/customer/bookings/history")
 def customer_booking_history():
     if session.get("role") != "customer":
@@ -1186,6 +3748,417 @@ def customer_booking_history():
         bookings=bookings
     )
 
+@app.route("/transactions/search")
+def transaction_search():
+    if session.get("role") not in ("owner", "admin"):
+        return redirect(url_for("login"))
+    try:
+        date_from = datetime.strptime(request.args["date_from"], "%Y-%m-%d").date() \
+            if request.args.get("date_from") else None
+        date_to = datetime.strptime(request.args["date_to"], "%Y-%m-%d").date() \
+            if request.args.get("date_to") else None
+    except ValueError:
+        return jsonify({"error": "Format tanggal tidak valid (YYYY-MM-DD)."}), 400
+
+    results = search_transactions(
+        current_branch_id(),
+        q=request.args.get("q"),
+        field=request.args.get("field"),
+        mode=request.args.get("mode", "prefix"),
+        date_from=date_from,
+        date_to=date_to,
+        limit=request.args.get("limit", 50, type=int),
+    )
+    return jsonify([
+        {
+            "id": t.id,
+            "date": t.date.strftime("%Y-%m-%d") if t.date else None,
+            "customer": t.customer,
+            "customer_username": t.customer_username,
+            "service_name": t.service_name,
+            "sparepart_name": t.sparepart_name,
+            "employee_name": t.employee_name,
+            "total": t.total or 0,
+            "status": t.status,
+        }
+        for t in results
+    ])
+
+
+@app.route("/vehicles/history")
+def vehicle_history_api():
+    if session.get("role") not in ("owner", "admin"):
+        return redirect(url_for("login"))
+    vehicle, history = vehicle_history(request.args.get("plate"))
+    if vehicle is None:
+        return jsonify({"error": "Kendaraan tidak ditemukan."}), 404
+    return jsonify({
+        "vehicle": {
+            "id": vehicle.id,
+            "plate": vehicle.plate,
+            "vehicle_type": vehicle.vehicle_type,
+            "customer_id": vehicle.customer_id,
+            "owner_name": vehicle.owner_name,
+            "owner_phone": vehicle.owner_phone,
+        },
+        "history": [
+            {
+                "id": t.id,
+                "date": t.date.strftime("%Y-%m-%d") if t.date else None,
+                "branch_id": t.branch_id,
+                "branch": branch_name,
+                "service_name": t.service_name,
+                "sparepart_name": t.sparepart_name,
+                "employee_name": t.employee_name,
+                "total": t.total or 0,
+                "status": t.status,
+            }
+            for t, branch_name in history
+        ],
+    })
+
+
+@app.route("/api/low-stock")
+def low_stock_api():
+    """Daftar stok menipis cabang aktif beserta saran pembelian (ROP - stok)."""
+    if session.get("role") not in ("owner", "admin"):
+        return redirect(url_for("login"))
+    branch_id = current_branch_id()
+    return jsonify({
+        "branch_id": branch_id,
+        "date": date.today().strftime("%Y-%m-%d"),
+        "items": [
+            {
+                "sparepart_id": row.sparepart_id,
+                "name": row.sparepart.name,
+                "stock": row.stock,
+                "rop": row.rop,
+                "reorder_qty": row.reorder_qty,
+            }
+            for row in low_stock_rows(branch_id)
+        ],
+    })
+
+
+@app.route("/audit/transactions/<int:trx_id>")
+def transaction_audit(trx_id):
+    if session.get("role") not in ("owner", "admin"):
+        return redirect(url_for("login"))
+    limit = max(1, min(request.args.get("limit", 100, type=int), 500))
+    return jsonify({
+        "transaction_id": trx_id,
+        "events": audit_history("transaction", trx_id, current_branch_id(), limit),
+    })
+
+
+@app.route("/audit/spareparts/<int:sp_id>")
+def sparepart_audit(sp_id):
+    if session.get("role") not in ("owner", "admin"):
+        return redirect(url_for("login"))
+    limit = max(1, min(request.args.get("limit", 100, type=int), 500))
+    return jsonify({
+        "sparepart_id": sp_id,
+        "events": audit_history("sparepart", sp_id, current_branch_id(), limit),
+    })
+
+# ---------------------------------------------------------------------------
+# Tugas harian stok: `flask --app app refresh-stock-alerts` / `purchase-suggestions`
+# ---------------------------------------------------------------------------
+import csv
+
+
+@app.cli.command("refresh-stock-alerts")
+def refresh_stock_alerts_command():
+    """Hitung ulang ROP & flag stok menipis yang belum diperbarui hari ini (semua cabang)."""
+    click.echo(f"{refresh_stale_stock_alerts()} baris stok diperbarui.")
+
+
+@app.cli.command("purchase-suggestions")
+@click.option("--output", type=click.Path(dir_okay=False), help="tulis CSV ke file (default: layar)")
+def purchase_suggestions_command(output):
+    """Laporan harian saran pembelian per cabang (jumlah = ROP - stok)."""
+    refresh_stale_stock_alerts()
+    rows = []
+    for branch in BranchDB.query.order_by(BranchDB.id.asc()).all():
+        for row in low_stock_rows(branch.id):
+            rows.append([date.today().isoformat(), branch.name, row.sparepart.name,
+                         row.stock, row.rop, row.reorder_qty])
+    header = ["tanggal", "cabang", "sparepart", "stok", "rop", "saran_beli"]
+    if output:
+        with open(output, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+        click.echo(f"{len(rows)} saran pembelian ditulis ke {output}")
+    else:
+        writer = csv.writer(sys.stdout)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+# ---------------------------------------------------------------------------
+# Skema database: `flask --app app upgrade-db`
+# ---------------------------------------------------------------------------
+import click
+from sqlalchemy.exc import OperationalError
+
+
+# index lama yang sudah digantikan index lain (berawalan branch_id / unique)
+LEGACY_INDEXES = {
+    "transactions": ("ix_transactions_date_total",),
+    "transaction_items": ("ix_transaction_items_sparepart_date",),
+    "attendance": ("ix_attendance_date", "ix_attendance_employee_date"),
+}
+
+
+def reset_derived_tables():
+    """
+    Tabel turunan (snapshot laporan & counter slot booking) yang kolomnya
+    berbeda dari model dihapus lalu dibuat ulang oleh create_all; isinya
+    dihitung lagi dari transaksi/booking.
+    """
+    inspector = db.inspect(db.engine)
+    for model in (ReportSnapshotDB, BookingSlotDB):
+        table = model.__table__
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        if existing != {c.name for c in table.columns}:
+            table.drop(db.engine)
+
+
+def ensure_default_branch():
+    if BranchDB.query.get(DEFAULT_BRANCH_ID) is None:
+        db.session.add(BranchDB(id=DEFAULT_BRANCH_ID, name="Pusat", address=""))
+        db.session.commit()
+
+
+MYSQL_ERR_DROP_INDEX_FK = 1553   # "needed in a foreign key constraint"
+
+
+def drop_legacy_indexes():
+    """
+    Hapus index lama yang sudah digantikan. Hasil: daftar "tabel.index" yang
+    dilewati karena MySQL masih memakainya untuk foreign key (error 1553).
+    """
+    skipped = []
+    inspector = db.inspect(db.engine)
+    for table_name, names in LEGACY_INDEXES.items():
+        if not inspector.has_table(table_name):
+            continue
+        existing = {ix["name"] for ix in inspector.get_indexes(table_name)}
+        for name in names:
+            if name not in existing:
+                continue
+            try:
+                with db.engine.begin() as conn:
+                    if db.engine.dialect.name == "mysql":
+                        conn.execute(text(f"DROP INDEX {name} ON {table_name}"))
+                    else:
+                        conn.execute(text(f"DROP INDEX {name}"))
+            except OperationalError as e:
+                # MySQL menolak menghapus index yang masih dipakai foreign key; error lain tetap dilempar
+                if getattr(e.orig, "args", (None,))[0] != MYSQL_ERR_DROP_INDEX_FK:
+                    raise
+                skipped.append(f"{table_name}.{name}")
+    return skipped
+
+
+def merge_duplicate_attendance():
+    """
+    Presensi ganda (employee_id, date) dari versi lama digabung sebelum unique
+    index dibuat: check-in paling awal dan check-out paling akhir disimpan di baris pertama.
+    """
+    duplicates = (
+        db.session.query(AttendanceDB.employee_id, AttendanceDB.date)
+        .group_by(AttendanceDB.employee_id, AttendanceDB.date)
+        .having(func.count(AttendanceDB.id) > 1)
+        .all()
+    )
+    for emp_id, day in duplicates:
+        rows = AttendanceDB.query.filter_by(employee_id=emp_id, date=day).order_by(AttendanceDB.id).all()
+        keep = rows[0]
+        keep.check_in = min((r.check_in for r in rows if r.check_in), default=None)
+        keep.check_out = max((r.check_out for r in rows if r.check_out), default=None)
+        for row in rows[1:]:
+            db.session.delete(row)
+    db.session.commit()
+
+
+def ensure_indexes():
+    """Buat index yang didefinisikan di model tapi belum ada di tabel lama."""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+
+def ensure_search_index():
+    dialect = db.engine.dialect.name
+    with db.engine.begin() as conn:
+        if dialect == "mysql":
+            exists = conn.execute(text(
+                "SELECT 1 FROM information_schema.statistics "
+                "WHERE table_schema = DATABASE() AND table_name = 'transactions' "
+                "AND index_name = 'ft_transactions_search'"
+            )).first()
+            if not exists:
+                conn.execute(text(
+                    "ALTER TABLE transactions ADD FULLTEXT INDEX ft_transactions_search "
+                    "(customer, customer_username, service_name, sparepart_name, employee_name) "
+                    "WITH PARSER ngram"
+                ))
+        elif dialect == "sqlite":
+            # tabel FTS5 sebagai pengganti FULLTEXT MySQL (mis. untuk testing)
+            exists = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'transactions_fts'"
+            )).first()
+            if not exists:
+                cols = ", ".join(SEARCH_FIELDS)
+                new_cols = ", ".join("new." + c for c in SEARCH_FIELDS)
+                old_cols = ", ".join("old." + c for c in SEARCH_FIELDS)
+                conn.execute(text(
+                    f"CREATE VIRTUAL TABLE transactions_fts USING fts5({cols}, "
+                    "content='transactions', content_rowid='id', tokenize='trigram')"
+                ))
+                conn.execute(text(
+                    "CREATE TRIGGER transactions_fts_ai AFTER INSERT ON transactions BEGIN "
+                    f"INSERT INTO transactions_fts(rowid, {cols}) VALUES (new.id, {new_cols}); END"
+                ))
+                conn.execute(text(
+                    "CREATE TRIGGER transactions_fts_ad AFTER DELETE ON transactions BEGIN "
+                    f"INSERT INTO transactions_fts(transactions_fts, rowid, {cols}) "
+                    f"VALUES ('delete', old.id, {old_cols}); END"
+                ))
+                conn.execute(text(
+                    "CREATE TRIGGER transactions_fts_au AFTER UPDATE ON transactions BEGIN "
+                    f"INSERT INTO transactions_fts(transactions_fts, rowid, {cols}) "
+                    f"VALUES ('delete', old.id, {old_cols}); "
+                    f"INSERT INTO transactions_fts(rowid, {cols}) VALUES (new.id, {new_cols}); END"
+                ))
+                conn.execute(text("INSERT INTO transactions_fts(transactions_fts) VALUES ('rebuild')"))
+
+
+def ensure_columns():
+    """Tambah kolom baru di model ke tabel lama (ALTER TABLE ... ADD COLUMN)."""
+    inspector = db.inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} " \
+                      f"{column.type.compile(dialect=db.engine.dialect)}"
+                if column.server_default is not None:
+                    ddl += f" NOT NULL DEFAULT {column.server_default.arg}"
+                conn.execute(text(ddl))
+
+
+def backfill_transaction_customer_ids():
+    """Isi transactions.customer_id dari customer_username untuk data lama."""
+    with db.engine.begin() as conn:
+        conn.execute(text(
+            "UPDATE transactions SET customer_id = "
+            "(SELECT users.id FROM users WHERE users.username = transactions.customer_username) "
+            "WHERE customer_id IS NULL"
+        ))
+
+
+def backfill_transaction_items():
+    """
+    Buat transaction_items untuk transaksi lama yang belum punya rincian:
+    dari sparepart_id (qty 1), atau dari teks "Nama x2, Nama x1" hasil booking.
+    """
+    spare_by_name = {sp.name: sp for sp in SparepartDB.query.all()}
+    has_items = db.session.query(TransactionItemDB.transaction_id).distinct()
+    legacy = TransactionDB.query.filter(
+        TransactionDB.id.notin_(has_items),
+        or_(TransactionDB.sparepart_id.isnot(None),
+            and_(TransactionDB.sparepart_name.isnot(None), TransactionDB.sparepart_name != "")),
+    ).all()
+    for trx in legacy:
+        lines = []
+        if trx.sparepart_id and trx.sparepart:
+            lines.append((trx.sparepart, 1, trx.price_spare or trx.sparepart.price))
+        else:
+            for part in (trx.sparepart_name or "").split(", "):
+                name, sep, qty = part.rpartition(" x")
+                if not sep or not qty.isdigit():
+                    name, qty = part, "1"
+                spare = spare_by_name.get(name.strip())
+                if spare:
+                    lines.append((spare, int(qty), spare.price))
+        set_transaction_items(trx, lines)
+    db.session.commit()
+
+
+def backfill_branch_stock():
+    """Stok lama di spareparts.stock dipindah ke branch_stock cabang pusat."""
+    has_stock = db.session.query(BranchStockDB.sparepart_id).distinct()
+    for sp in SparepartDB.query.filter(SparepartDB.id.notin_(has_stock)).all():
+        db.session.add(BranchStockDB(branch_id=DEFAULT_BRANCH_ID, sparepart_id=sp.id, stock=sp.stock or 0))
+    db.session.commit()
+
+
+def import_legacy_vehicles(path=os.path.join(app.root_path, "data", "vehicle.json")):
+    """Kendaraan dari data/vehicle.json (versi lama tanpa database) masuk ke tabel vehicles."""
+    if not os.path.exists(path):
+        return
+    with open(path, encoding="utf-8") as f:
+        rows = json.load(f)
+    for row in rows:
+        customer = UserDB.query.filter_by(full_name=row.get("customer_name"), role="customer").first() \
+            if row.get("customer_name") else None
+        get_or_create_vehicle(
+            row.get("plate"), customer,
+            vehicle_type=row.get("type"),
+            owner_name=row.get("customer_name"),
+            owner_phone=row.get("customer_phone"),
+        )
+    db.session.commit()
+
+
+def upgrade_db():
+    reset_derived_tables()
+    db.create_all()
+    ensure_default_branch()
+    ensure_columns()
+    merge_duplicate_attendance()
+    ensure_indexes()
+    skipped_indexes = drop_legacy_indexes()   # setelah index pengganti ada (MySQL: index untuk foreign key)
+    ensure_search_index()
+    rebuild_booking_slots()
+    backfill_transaction_customer_ids()
+    backfill_transaction_items()
+    backfill_branch_stock()
+    import_legacy_vehicles()
+    return skipped_indexes
+
+
+@app.cli.command("upgrade-db")
+def upgrade_db_command():
+    """Buat tabel & index yang belum ada tanpa menghapus data."""
+    skipped_indexes = upgrade_db()
+    for name in skipped_indexes:
+        click.echo(f"Index lama {name} tidak bisa dihapus (masih dipakai foreign key).", err=True)
+    if skipped_indexes:
+        click.echo("Skema database diperbarui, tetapi index lama di atas masih ada.")
+    else:
+        click.echo("Skema database sudah diperbarui.")
+
+
+def ensure_sqlite_schema():
+    """Mode SQLite berdiri sendiri: buat skema otomatis kalau file database masih kosong."""
+    if not using_sqlite():
+        return
+    with app.app_context():
+        if not db.inspect(db.engine).has_table(UserDB.__tablename__):
+            upgrade_db()
+
+
 if __name__ == "__main__":
-    # jalankan server saja, tanpa create_all setiap start
+    # jalankan server saja, tanpa create_all setiap start (kecuali database SQLite baru)
+    ensure_sqlite_schema()
     app.run(debug=True)
\ No newline at end of file
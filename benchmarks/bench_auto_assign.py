@@ -0,0 +1,98 @@
+"""
+Benchmark pembagian job otomatis (auto_assign_jobs) terhadap database berisi
+ribuan transaksi Proses yang belum ditugaskan. Waktu yang diukur mencakup
+query beban mekanik, SELECT ... FOR UPDATE, bulk update, audit, flush & commit.
+
+Jalankan dari root repo (default memakai file SQLite sementara):
+    python benchmarks/bench_auto_assign.py
+    DATABASE_URL=mysql+pymysql://... python benchmarks/bench_auto_assign.py
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench_auto_assign.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db, upgrade_db, auto_assign_jobs, audit_writer, \
+    BranchDB, EmployeeDB, ServiceDB, TransactionDB, UserDB  # noqa: E402
+
+BENCH_PREFIX = "bench_aa"
+
+
+def seed_branch(n_jobs, n_mechanics):
+    """Buat 1 cabang baru berisi n_mechanics mekanik aktif dan n_jobs job Proses tanpa karyawan."""
+    branch = BranchDB(name=f"{BENCH_PREFIX} {n_jobs}/{n_mechanics} {time.time_ns()}", address="")
+    db.session.add(branch)
+    service = ServiceDB.query.filter_by(name=f"{BENCH_PREFIX} servis").first()
+    if service is None:
+        service = ServiceDB(name=f"{BENCH_PREFIX} servis", price=50000, description="")
+        db.session.add(service)
+    db.session.flush()
+    for i in range(n_mechanics):
+        user = UserDB(username=f"{BENCH_PREFIX}_{branch.id}_{i}", password="x",
+                      full_name=f"Mekanik {i}", role="employee")
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(EmployeeDB(user_id=user.id, branch_id=branch.id, name=f"Mekanik {i}",
+                                  position="Mekanik", status="Aktif"))
+    today = date.today()
+    db.session.execute(TransactionDB.__table__.insert(), [
+        {
+            "branch_id": branch.id,
+            "date": today - timedelta(days=random.randint(0, 30)),
+            "customer_username": f"{BENCH_PREFIX}_cust",
+            "customer": "Customer Bench",
+            "service_id": service.id,
+            "service_name": service.name,
+            "price_service": service.price,
+            "total": service.price,
+            "status": "Proses",
+        }
+        for _ in range(n_jobs)
+    ])
+    db.session.commit()
+    return branch.id
+
+
+def reset_jobs(branch_id):
+    TransactionDB.query.filter_by(branch_id=branch_id).update(
+        {"employee_id": None, "employee_name": None, "assigned_at": None}, synchronize_session=False
+    )
+    db.session.commit()
+
+
+def bench(n_jobs, n_mechanics, repeat=3):
+    branch_id = seed_branch(n_jobs, n_mechanics)
+    best = None
+    for _ in range(repeat):
+        reset_jobs(branch_id)
+        start = time.perf_counter()
+        assigned = auto_assign_jobs(branch_id)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        assert assigned == n_jobs, (assigned, n_jobs)
+    audit_writer.flush()
+
+    loads = [
+        count for _, count in
+        db.session.query(TransactionDB.employee_id, db.func.count(TransactionDB.id))
+        .filter(TransactionDB.branch_id == branch_id)
+        .group_by(TransactionDB.employee_id)
+        .all()
+    ]
+    spread = max(loads) - min(loads)
+    print(f"{n_jobs:>7} job / {n_mechanics:>3} mekanik: {best * 1000:8.1f} ms  (selisih beban akhir: {spread})")
+
+
+if __name__ == "__main__":
+    random.seed(42)
+    with app.app_context():
+        print("database:", db.engine.url.render_as_string(hide_password=True))
+        upgrade_db()
+        for n_jobs, n_mechanics in [(1000, 5), (5000, 10), (20000, 25)]:
+            bench(n_jobs, n_mechanics)
@@ -0,0 +1,370 @@
+"""
+Load test multi-role untuk aplikasi bengkel.
+
+Setiap "virtual user" login sesuai role di tabel users lalu menjalankan alur
+yang biasa dilakukan di bengkel:
+  - customer : dashboard, cek slot, booking, riwayat booking
+  - admin    : dashboard, buat transaksi dari booking, penugasan, stok, laporan
+  - employee : dashboard, update status job, presensi
+  - owner    : dashboard, laporan, transaksi, analitik, rekap presensi
+
+Di akhir ditampilkan throughput dan latency p50/p95/p99 per route.
+
+Contoh:
+    # 1. isi database (memakai konfigurasi database di app.py)
+    python benchmarks/loadtest.py seed --customers 50 --mechanics 5
+
+    # 2. jalankan server di terminal lain
+    python app.py
+
+    # 3. jalankan load test
+    python benchmarks/loadtest.py run --base-url http://127.0.0.1:5000 \
+        --duration 60 --customers 20 --admins 3 --employees 5 --owners 1
+
+    # uji presensi serentak saat shift mulai (semua mekanik klik Hadir bersamaan,
+    # beberapa kali); gagal (exit 1) kalau ada karyawan dengan >1 baris hari ini
+    python benchmarks/loadtest.py attendance-burst --employees 5 --clicks 4
+"""
+import argparse
+import http.cookiejar
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from datetime import date, timedelta
+
+PASSWORD = "loadtest"
+CUSTOMER_PREFIX = "lt_cust"
+MECHANIC_PREFIX = "lt_mech"
+ADMIN_USER = "lt_admin"
+OWNER_USER = "lt_owner"
+SERVICES = [("Service Ringan", 150000, 60), ("Service Berat", 350000, 120), ("Ganti Oli", 90000, 30)]
+SPAREPARTS = [("Oli Mesin", 50000), ("Kampas Rem Depan", 55000), ("Filter Udara", 40000)]
+
+
+# ---------------------------------------------------------------------------
+# Seed data
+# ---------------------------------------------------------------------------
+def seed(n_customers, n_mechanics):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from app import app, db, upgrade_db, get_branch_stock, UserDB, EmployeeDB, ServiceDB, SparepartDB, \
+        DEFAULT_BRANCH_ID
+
+    with app.app_context():
+        upgrade_db()
+
+        def ensure_user(username, role, full_name):
+            user = UserDB.query.filter_by(username=username).first()
+            if user is None:
+                user = UserDB(username=username, password=PASSWORD, full_name=full_name, role=role)
+                db.session.add(user)
+                db.session.flush()
+            return user
+
+        ensure_user(OWNER_USER, "owner", "Owner Load Test")
+        ensure_user(ADMIN_USER, "admin", "Admin Load Test")
+        for i in range(1, n_customers + 1):
+            ensure_user(f"{CUSTOMER_PREFIX}{i}", "customer", f"Customer {i}")
+        for i in range(1, n_mechanics + 1):
+            user = ensure_user(f"{MECHANIC_PREFIX}{i}", "employee", f"Mekanik {i}")
+            if EmployeeDB.query.filter_by(user_id=user.id).first() is None:
+                db.session.add(EmployeeDB(user_id=user.id, name=f"Mekanik {i}", position="Mekanik", status="Aktif"))
+
+        for name, price, duration in SERVICES:
+            if ServiceDB.query.filter_by(name=name).first() is None:
+                db.session.add(ServiceDB(name=name, price=price, duration_minutes=duration, description=""))
+        for name, price in SPAREPARTS:
+            part = SparepartDB.query.filter_by(name=name).first()
+            if part is None:
+                part = SparepartDB(name=name, price=price, stock=0)
+                db.session.add(part)
+                db.session.flush()
+            row = get_branch_stock(DEFAULT_BRANCH_ID, part.id)
+            row.stock = max(row.stock or 0, 100000)
+        db.session.commit()
+    print(f"Seed selesai: {n_customers} customer, {n_mechanics} mekanik, 1 admin, 1 owner.")
+
+
+# ---------------------------------------------------------------------------
+# Klien HTTP & pencatat latency
+# ---------------------------------------------------------------------------
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, route, seconds, ok):
+        with self._lock:
+            self.latencies[route].append(seconds)
+            if not ok:
+                self.errors[route] += 1
+
+
+class Client:
+    """Satu sesi browser (cookie sendiri) yang mencatat setiap request."""
+
+    def __init__(self, base_url, stats):
+        self.base_url = base_url.rstrip("/")
+        self.stats = stats
+        self.last_ok = None
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar())
+        )
+
+    def request(self, route, path, data=None):
+        url = self.base_url + path
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        start = time.perf_counter()
+        ok = True
+        text = ""
+        try:
+            with self.opener.open(url, data=body, timeout=30) as res:
+                text = res.read().decode("utf-8", errors="replace")
+                # berakhir di halaman login = login gagal / sesi hilang, walau status 200
+                ok = res.status < 400 and urllib.parse.urlsplit(res.geturl()).path != "/login"
+        except urllib.error.HTTPError as e:
+            ok = False
+            e.read()
+        except (urllib.error.URLError, OSError):
+            ok = False
+        self.stats.record(route, time.perf_counter() - start, ok)
+        self.last_ok = ok
+        return text
+
+    def get(self, route, path):
+        return self.request(route, path)
+
+    def post(self, route, path, data):
+        return self.request(route, path, data)
+
+    def login(self, username):
+        """True kalau login berhasil (diarahkan ke dashboard, bukan kembali ke /login)."""
+        self.post("POST /login", "/login", {"username": username, "password": PASSWORD})
+        return self.last_ok
+
+
+# ---------------------------------------------------------------------------
+# Alur per role
+# ---------------------------------------------------------------------------
+def customer_flow(client, rng):
+    client.get("GET /customer-dashboard", "/customer-dashboard")
+    client.get("GET /customer/booking", "/customer/booking")
+    day = (date.today() + timedelta(days=rng.randint(1, 14))).strftime("%Y-%m-%d")
+    service = rng.choice(SERVICES)[0]
+    query = urllib.parse.urlencode({"date": day, "service": service})
+    client.get("GET /customer/booking/slots", "/customer/booking/slots?" + query)
+    cart = '[{"name": "%s", "qty": %d}]' % (rng.choice(SPAREPARTS)[0], rng.randint(1, 2))
+    client.post("POST /customer/booking", "/customer/booking", {
+        "date": day,
+        "time": f"{rng.randint(8, 15):02d}:{rng.choice(['00', '30'])}",
+        "service": service,
+        "note": "load test",
+        "cart_json": cart,
+    })
+    client.get("GET /customer/bookings/history", "/customer/bookings/history")
+
+
+BOOKING_RE = re.compile(r'name="booking_id" value="(\d+)"')
+TRX_OPTION_RE = re.compile(r'<option value="(\d+)">\s*ID \d+')
+EMP_OPTION_RE = re.compile(r'<option value="(\d+)">[^<]* - ')
+JOB_ID_RE = re.compile(r'name="id" value="(\d+)"')
+
+
+def admin_flow(client, rng):
+    client.get("GET /admin-dashboard", "/admin-dashboard")
+    page = client.get("GET /admin/jobs", "/admin/jobs")
+    bookings = BOOKING_RE.findall(page)
+    if bookings:
+        client.post("POST /admin/jobs (create_from_booking)", "/admin/jobs", {
+            "action": "create_from_booking",
+            "booking_id": rng.choice(bookings),
+        })
+        page = client.get("GET /admin/jobs", "/admin/jobs")
+    trx_ids = TRX_OPTION_RE.findall(page)
+    emp_ids = EMP_OPTION_RE.findall(page)
+    if trx_ids and emp_ids:
+        client.post("POST /admin/jobs (assign_job)", "/admin/jobs", {
+            "action": "assign_job",
+            "trx_id": rng.choice(trx_ids),
+            "emp_id": rng.choice(emp_ids),
+        })
+    client.get("GET /admin/stock", "/admin/stock")
+    client.get("GET /admin/report", "/admin/report")
+
+
+def employee_flow(client, rng):
+    page = client.get("GET /employee-dashboard", "/employee-dashboard")
+    job_ids = JOB_ID_RE.findall(page)
+    if job_ids:
+        client.post("POST /employee/jobs/update", "/employee/jobs/update", {
+            "id": rng.choice(job_ids),
+            "status": rng.choice(["Proses", "Menunggu Sparepart", "Selesai"]),
+        })
+    client.post("POST /employee/attendance", "/employee/attendance", {
+        "status": rng.choice(["Hadir", "Pulang"]),
+    })
+    client.get("GET /employee/attendance", "/employee/attendance")
+
+
+def owner_flow(client, rng):
+    today = date.today()
+    client.get("GET /owner-dashboard", "/owner-dashboard")
+    client.get("GET /owner/reports", f"/owner/reports?month={today.month}&year={today.year}")
+    client.get("GET /owner/transactions", "/owner/transactions")
+    group_by = rng.choice(["service", "employee", "sparepart", "month"])
+    client.get("GET /owner/analytics", f"/owner/analytics?group_by={group_by}")
+    client.get("GET /owner/attendance", "/owner/attendance")
+
+
+def virtual_user(base_url, username, flow, stats, deadline, think_time, seed_value):
+    rng = random.Random(seed_value)
+    client = Client(base_url, stats)
+    if not client.login(username):
+        return   # sudah tercatat sebagai error di POST /login
+    while time.time() < deadline:
+        flow(client, rng)
+        if think_time:
+            time.sleep(rng.uniform(0, think_time))
+
+
+# ---------------------------------------------------------------------------
+# Laporan
+# ---------------------------------------------------------------------------
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def print_report(stats, elapsed):
+    header = f"{'Route':<42} {'Req':>7} {'Err':>5} {'Req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    print(header)
+    print("-" * len(header))
+    total = 0
+    for route in sorted(stats.latencies):
+        values = sorted(stats.latencies[route])
+        total += len(values)
+        print(
+            f"{route:<42} {len(values):>7} {stats.errors.get(route, 0):>5} "
+            f"{len(values) / elapsed:>8.1f} "
+            f"{percentile(values, 50) * 1000:>9.1f} "
+            f"{percentile(values, 95) * 1000:>9.1f} "
+            f"{percentile(values, 99) * 1000:>9.1f}"
+        )
+    print("-" * len(header))
+    print(f"Total {total} request dalam {elapsed:.1f} detik = {total / elapsed:.1f} req/s")
+
+
+def run(args):
+    stats = Stats()
+    deadline = time.time() + args.duration
+    plan = (
+        [(f"{CUSTOMER_PREFIX}{i}", customer_flow) for i in range(1, args.customers + 1)]
+        + [(ADMIN_USER, admin_flow) for _ in range(args.admins)]
+        + [(f"{MECHANIC_PREFIX}{i}", employee_flow) for i in range(1, args.employees + 1)]
+        + [(OWNER_USER, owner_flow) for _ in range(args.owners)]
+    )
+    threads = [
+        threading.Thread(
+            target=virtual_user,
+            args=(args.base_url, username, flow, stats, deadline, args.think_time, n),
+            daemon=True,
+        )
+        for n, (username, flow) in enumerate(plan)
+    ]
+    started = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    print_report(stats, time.time() - started)
+
+
+def attendance_burst(args):
+    stats = Stats()
+    clients = []
+    for i in range(1, args.employees + 1):
+        for _ in range(args.clicks):
+            client = Client(args.base_url, stats)
+            client.login(f"{MECHANIC_PREFIX}{i}")
+            clients.append(client)
+    barrier = threading.Barrier(len(clients))
+
+    def press(client):
+        barrier.wait()
+        client.post("POST /employee/attendance (burst)", "/employee/attendance", {"status": "Hadir"})
+
+    threads = [threading.Thread(target=press, args=(c,), daemon=True) for c in clients]
+    started = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    print_report(stats, time.time() - started)
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from sqlalchemy import func
+    from app import app, db, AttendanceDB, EmployeeDB, UserDB
+
+    usernames = [f"{MECHANIC_PREFIX}{i}" for i in range(1, args.employees + 1)]
+    with app.app_context():
+        rows = (
+            db.session.query(UserDB.username, func.count(AttendanceDB.id), func.min(AttendanceDB.check_in))
+            .join(EmployeeDB, EmployeeDB.user_id == UserDB.id)
+            .outerjoin(AttendanceDB, (AttendanceDB.employee_id == EmployeeDB.id) & (AttendanceDB.date == date.today()))
+            .filter(UserDB.username.in_(usernames))
+            .group_by(UserDB.username)
+            .all()
+        )
+    bad = [(username, count) for username, count, _ in rows if count != 1]
+    for username, count, check_in in sorted(rows):
+        print(f"{username:<12} baris presensi hari ini: {count}  check-in: {check_in}")
+    if bad:
+        print(f"GAGAL: {len(bad)} karyawan tidak punya tepat 1 baris presensi hari ini.")
+        sys.exit(1)
+    print(f"OK: {len(rows)} karyawan x {args.clicks} klik -> tepat 1 baris per karyawan.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_seed = sub.add_parser("seed", help="buat user load test di database")
+    p_seed.add_argument("--customers", type=int, default=50)
+    p_seed.add_argument("--mechanics", type=int, default=5)
+
+    p_run = sub.add_parser("run", help="jalankan load test ke server yang sedang berjalan")
+    p_run.add_argument("--base-url", default="http://127.0.0.1:5000")
+    p_run.add_argument("--duration", type=int, default=60, help="lama test (detik)")
+    p_run.add_argument("--customers", type=int, default=10)
+    p_run.add_argument("--admins", type=int, default=2)
+    p_run.add_argument("--employees", type=int, default=3)
+    p_run.add_argument("--owners", type=int, default=1)
+    p_run.add_argument("--think-time", type=float, default=0.5, help="jeda acak maks antar alur (detik)")
+
+    p_burst = sub.add_parser("attendance-burst", help="uji presensi serentak (cek tidak ada baris ganda)")
+    p_burst.add_argument("--base-url", default="http://127.0.0.1:5000")
+    p_burst.add_argument("--employees", type=int, default=5)
+    p_burst.add_argument("--clicks", type=int, default=4, help="request bersamaan per karyawan")
+
+    args = parser.parse_args()
+    if args.command == "seed":
+        seed(args.customers, args.mechanics)
+    elif args.command == "attendance-burst":
+        attendance_burst(args)
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
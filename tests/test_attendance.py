@@ -0,0 +1,118 @@
+"""
+Presensi serentak tanpa server: banyak thread memanggil record_attendance untuk
+karyawan & hari yang sama di database SQLite sementara. Hasilnya harus tepat
+1 baris per (employee_id, date) dengan check-in/check-out tergabung.
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+import tempfile
+import threading
+from datetime import date, time
+
+import pytest
+
+_tmp_dir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(_tmp_dir, "attendance.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func  # noqa: E402
+from sqlalchemy.exc import IntegrityError  # noqa: E402
+from app import app, db, upgrade_db, record_attendance, AttendanceDB, EmployeeDB, UserDB  # noqa: E402
+
+EMPLOYEES = 5
+THREADS_PER_EMPLOYEE = 6
+
+
+@pytest.fixture(scope="module")
+def employee_ids():
+    with app.app_context():
+        upgrade_db()
+        ids = []
+        for i in range(EMPLOYEES):
+            user = UserDB(username=f"presensi{i}", password="x", full_name=f"Mekanik {i}", role="employee")
+            db.session.add(user)
+            db.session.flush()
+            employee = EmployeeDB(user_id=user.id, name=f"Mekanik {i}", position="Mekanik", status="Aktif")
+            db.session.add(employee)
+            db.session.flush()
+            ids.append(employee.id)
+        db.session.commit()
+        return ids
+
+
+def _fire(calls):
+    """Jalankan semua (employee_id, day, status, jam) bersamaan; kembalikan error dari thread."""
+    barrier = threading.Barrier(len(calls))
+    errors = []
+
+    def worker(emp_id, day, status, at_time):
+        barrier.wait()
+        try:
+            with app.app_context():
+                record_attendance(db.session.get(EmployeeDB, emp_id), day, status, at_time)
+        except Exception as e:  # dilaporkan lewat assert di test
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=call) for call in calls]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return errors
+
+
+def _rows(day):
+    with app.app_context():
+        return {
+            a.employee_id: a
+            for a in AttendanceDB.query.filter_by(date=day).all()
+        }, dict(
+            db.session.query(AttendanceDB.employee_id, func.count(AttendanceDB.id))
+            .filter(AttendanceDB.date == day)
+            .group_by(AttendanceDB.employee_id)
+            .all()
+        )
+
+
+def test_concurrent_check_in_creates_one_row_per_employee(employee_ids):
+    day = date(2026, 10, 1)
+    check_ins = [time(7, m) for m in range(THREADS_PER_EMPLOYEE)]
+    check_outs = [time(17, m) for m in range(THREADS_PER_EMPLOYEE)]
+    calls = [(emp_id, day, "Hadir", t) for emp_id in employee_ids for t in check_ins]
+    calls += [(emp_id, day, "Pulang", t) for emp_id in employee_ids for t in check_outs]
+
+    assert _fire(calls) == []
+
+    rows, counts = _rows(day)
+    assert counts == {emp_id: 1 for emp_id in employee_ids}
+    for emp_id in employee_ids:
+        # check-in yang pertama masuk dipertahankan, check-out dari salah satu klik Pulang
+        assert rows[emp_id].check_in in check_ins
+        assert rows[emp_id].check_out in check_outs
+        assert rows[emp_id].branch_id is not None
+
+
+def test_check_in_kept_and_check_out_updated(employee_ids):
+    day = date(2026, 10, 2)
+    emp_id = employee_ids[0]
+    for status, at_time in [("Hadir", time(8, 0)), ("Hadir", time(8, 5)),
+                            ("Pulang", time(16, 0)), ("Pulang", time(17, 30))]:
+        assert _fire([(emp_id, day, status, at_time)]) == []
+
+    rows, counts = _rows(day)
+    assert counts == {emp_id: 1}
+    assert rows[emp_id].check_in == time(8, 0)
+    assert rows[emp_id].check_out == time(17, 30)
+
+
+def test_duplicate_insert_rejected_by_unique_index(employee_ids):
+    day = date(2026, 10, 3)
+    with app.app_context():
+        db.session.add(AttendanceDB(employee_id=employee_ids[1], date=day, check_in=time(7, 0)))
+        db.session.commit()
+        db.session.add(AttendanceDB(employee_id=employee_ids[1], date=day, check_in=time(7, 1)))
+        with pytest.raises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()